@@ -0,0 +1,134 @@
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+# Utenti di cui si ricorda il secchio: oltre, si dimenticano quelli fermi da più tempo
+MAX_USERS = 10_000
+
+# Ogni quanto, al massimo, avvisare lo stesso utente che i suoi messaggi vengono scartati
+WARN_EVERY = 10.0
+
+# Latenze tenute per le statistiche (per tipo di richiesta)
+LATENCY_SAMPLES = 512
+
+
+class TokenBucket:
+    """
+    Secchio di gettoni: se ne riempie a rate al secondo fino a capacity.
+    Una richiesta passa se trova abbastanza gettoni: si concedono raffiche brevi
+    (fino a capacity) ma non più di rate richieste al secondo sul lungo periodo.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float, now: float | None = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic() if now is None else now
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def take(self, cost: float, now: float | None = None) -> bool:
+        self.refill(time.monotonic() if now is None else now)
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class Admission:
+    """
+    Controllo di ammissione davanti agli handler pesanti: un secchio per utente (nessuno
+    può monopolizzare il bot) e uno globale (il bot nel suo insieme non accetta più lavoro
+    di quanto ne smaltisca), più un tetto agli aggiornamenti in coda. Quello che non passa
+    si scarta subito, con una risposta che non costa nulla.
+    Tiene anche le statistiche: ammessi, scartati, in corso e latenze per tipo di richiesta.
+    Gira tutto nell'event loop, quindi niente lock.
+    """
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float,
+                 max_queue: int):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.max_queue = max_queue
+        self._users: OrderedDict[int, TokenBucket] = OrderedDict()
+        self._warned: dict[int, float] = {}
+        self.admitted: dict[str, int] = {}
+        self.shed: dict[str, int] = {}
+        self.running: dict[str, int] = {}
+        self.latency: dict[str, deque[float]] = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+
+    def _user(self, user_id: int, now: float) -> TokenBucket:
+        bucket = self._users.pop(user_id, None)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst, now)
+            while len(self._users) >= MAX_USERS:
+                self._users.popitem(last=False)
+        self._users[user_id] = bucket  # in fondo: il primo è il meno recente
+        return bucket
+
+    def admit(self, user_id: int, kind: str, cost: float, queue_depth: int = 0) -> bool:
+        """La richiesta (costo in gettoni) può passare? Se sì i gettoni si consumano."""
+        now = time.monotonic()
+        self.queue_depth = queue_depth
+        self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+
+        user = self._user(user_id, now)
+        user.refill(now)
+        self.global_bucket.refill(now)
+        # si consuma solo se passano entrambi: chi viene scartato dal globale non perde i suoi gettoni
+        if queue_depth >= self.max_queue or user.tokens < cost or self.global_bucket.tokens < cost:
+            self.shed[kind] = self.shed.get(kind, 0) + 1
+            return False
+        user.tokens -= cost
+        self.global_bucket.tokens -= cost
+        self.admitted[kind] = self.admitted.get(kind, 0) + 1
+        return True
+
+    def should_warn(self, user_id: int) -> bool:
+        """Avvisare l'utente scartato? Una volta ogni WARN_EVERY secondi, gli altri messaggi si ignorano."""
+        now = time.monotonic()
+        if now - self._warned.get(user_id, -WARN_EVERY) < WARN_EVERY:
+            return False
+        if len(self._warned) >= MAX_USERS:
+            self._warned.clear()
+        self._warned[user_id] = now
+        return True
+
+    @contextmanager
+    def track(self, kind: str):
+        """Conta la richiesta come in corso e ne misura la durata."""
+        self.running[kind] = self.running.get(kind, 0) + 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.running[kind] -= 1
+            samples = self.latency.setdefault(kind, deque(maxlen=LATENCY_SAMPLES))
+            samples.append(time.perf_counter() - start)
+
+    def report(self) -> str:
+        """Le statistiche in forma leggibile (per /load)."""
+        self.global_bucket.refill(time.monotonic())
+        lines = [
+            f"📥 Aggiornamenti in coda: {self.queue_depth} (massimo visto {self.max_queue_depth}, limite {self.max_queue})",
+            f"🪣 Gettoni globali: {self.global_bucket.tokens:.1f}/{self.global_bucket.capacity:g}",
+            f"👥 Utenti tracciati: {len(self._users)}",
+        ]
+        for kind in sorted(self.admitted.keys() | self.shed.keys()):
+            line = (f"• {kind}: {self.admitted.get(kind, 0)} ammessi, {self.shed.get(kind, 0)} scartati, "
+                    f"{self.running.get(kind, 0)} in corso")
+            samples = sorted(self.latency.get(kind, ()))
+            if samples:
+                p50 = samples[len(samples) // 2]
+                p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+                line += f", latenza p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms"
+            lines.append(line)
+        return "\n".join(lines)
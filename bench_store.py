@@ -0,0 +1,84 @@
+"""
+Quanto costa una modifica (add_answer, append_answer, delete) al crescere della banca:
+deve dipendere dalla card, non da quante domande (o lapidi) ci sono.
+
+    python bench_store.py                       → banche da 10.000 e 100.000 domande
+    python bench_store.py 10000 1000000 --no-warm
+
+Le banche sono sintetiche (domande di db.json con parole cambiate), con il 9% di domande
+già eliminate (appena sotto la soglia della compattazione). Con --no-warm si costruisce solo
+l'indice di ricerca. Il salvataggio su file è spento: si misura il lavoro in memoria, quello
+che avviene col lock preso.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import kb_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+OPS = 300
+
+
+def make_bank(n: int, rng: random.Random, path: str) -> kb_store.Bank:
+    with open(os.path.join(HERE, "db.json"), encoding="utf-8") as file:
+        base = json.load(file)["questions"]
+    words = sorted({w for q in base for text in [q["question"], *q["answers"]] for w in text.split() if len(w) > 3})
+
+    def vary(text: str) -> str:
+        return " ".join(rng.choice(words) if rng.random() < 0.3 else w for w in text.split())
+
+    questions = [{"question": vary(q["question"]), "answers": [vary(a) for a in q["answers"]]}
+                 for q in (base[i % len(base)] for i in range(n))]
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"questions": questions}, file, ensure_ascii=False)
+    bank = kb_store.Bank("bench", path)
+    bank._save_later = lambda: None
+    return bank
+
+
+def timed(fn, args_list) -> float:
+    """Tempo mediano di fn(*args) in millisecondi."""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Costo delle modifiche a una banca, per dimensione.")
+    parser.add_argument("sizes", type=int, nargs="*", default=[10_000, 100_000])
+    parser.add_argument("--no-warm", action="store_true", help="solo l'indice di ricerca, non tutte le strutture")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            start = time.perf_counter()
+            bank = make_bank(n, rng, os.path.join(tmp, f"bench{n}.json"))
+            for card in rng.sample(bank.snapshot.cards, n * 9 // 100):
+                bank.delete(card.id)
+            if args.no_warm:
+                bank.snapshot.build("shards")
+            else:
+                bank.warm()
+            setup = time.perf_counter() - start
+
+            ids = [c.id for c in rng.sample(bank.snapshot.cards, 3 * OPS)]
+            add = timed(bank.add_answer, [(f"domanda nuova {i}?", f"Sintesi: risposta {i}") for i in range(OPS)])
+            append = timed(bank.append_answer, [(card_id, "Collegamenti: bench") for card_id in ids[:OPS]])
+            delete = timed(bank.delete, [(card_id,) for card_id in ids[OPS:2 * OPS]])
+            print(f"{n:>9} domande ({len(bank.snapshot.deleted)} lapidi, preparate in {setup:.0f} s): "
+                  f"add {add:.2f} ms, append {append:.2f} ms, delete {delete:.2f} ms")
+            bank.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import random
+import sys
+import zlib
+
+import numpy as np
+
+from grading import terms
+from kb_search import normalize
+
+
+# MinHash: NUM_PERM permutazioni, divise in BANDS bande da ROWS righe per l'LSH.
+# Con 16 bande da 4 righe due domande con similarità 0.75 finiscono nello stesso
+# bucket almeno una volta con probabilità > 99%; i candidati vengono poi verificati.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+
+# Similarità (Jaccard sulle parole chiave) oltre la quale due domande sono "la stessa"
+DUP_THRESHOLD = 0.75
+
+# (a * h + b) mod _PRIME con a, b, h minori di _PRIME (31 bit): il conto sta in un uint64
+_PRIME = (1 << 31) - 1
+_rng = random.Random(267)  # seme fisso: le firme devono essere uguali tra un avvio e l'altro
+_A = np.array([_rng.randrange(1, _PRIME) for _ in range(NUM_PERM)], dtype=np.uint64)
+_B = np.array([_rng.randrange(0, _PRIME) for _ in range(NUM_PERM)], dtype=np.uint64)
+# per ridurre le ROWS righe di una banda a un solo intero (moltiplicazioni modulo 2^64)
+_MIX = np.array([_rng.randrange(1, 1 << 64) | 1 for _ in range(ROWS)], dtype=np.uint64)
+
+
+def features(question: str) -> frozenset[str]:
+    """
+    Parole chiave della domanda (radici, senza "cos'è", "quali sono", articoli…) + i numeri:
+    "Cos'è il TUEL?" e "cosa è il tuel" → {tuel}, ma "ART N. 5" e "ART N. 15" restano diversi.
+    """
+    words = set(terms(question))
+    words.update(w for w in normalize(question).split() if w.isdigit())
+    # le stesse parole tornano in tante domande: una copia sola per tutte
+    return frozenset(sys.intern(w) for w in words)
+
+
+def signature(feats: frozenset[str]) -> np.ndarray:
+    """La firma MinHash: per ogni permutazione, il minimo sulle parole chiave."""
+    hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) % _PRIME for f in feats), dtype=np.uint64, count=len(feats))
+    return ((hashes[:, None] * _A + _B) % np.uint64(_PRIME)).min(axis=0)
+
+
+def band_keys(feats: frozenset[str]) -> list[int]:
+    """Un intero per banda (le sue ROWS righe della firma mescolate): la chiave del bucket."""
+    with np.errstate(over="ignore"):
+        return (signature(feats).reshape(BANDS, ROWS) @ _MIX).tolist()
+
+
+class Fingerprint:
+    """Parole chiave e chiavi dei bucket di una domanda: si calcolano una volta e si riusano."""
+
+    __slots__ = ("features", "bands")
+
+    def __init__(self, question: str):
+        self.features = features(question)
+        self.bands = band_keys(self.features) if self.features else []
+
+
+def jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _members(bucket: int | tuple[int, ...]) -> tuple[int, ...]:
+    return bucket if isinstance(bucket, tuple) else (bucket,)
+
+
+class NearDuplicateIndex:
+    """
+    Indice LSH delle domande: trova quelle quasi uguali a una domanda nuova
+    guardando solo i bucket in cui cade, non tutta la banca.
+    Aggiungere o togliere una domanda tocca solo i suoi BANDS bucket.
+    Un bucket è la chiave della sua unica domanda (il caso di gran lunga più comune) o una
+    tupla di chiavi: costa molto meno di un set, e chi legge mentre un altro scrive
+    vede sempre un bucket intero.
+    """
+
+    def __init__(self):
+        self._features: dict[int, frozenset[str]] = {}
+        self._buckets: list[dict[int, int | tuple[int, ...]]] = [{} for _ in range(BANDS)]
+
+    @classmethod
+    def build(cls, cards) -> "NearDuplicateIndex":
+        index = cls()
+        for card in cards:
+            index.add(card.id, card.question)
+        return index
+
+    def add(self, key: int, question: str, fingerprint: Fingerprint | None = None):
+        fp = fingerprint or Fingerprint(question)
+        if not fp.features:
+            return
+        self._features[key] = fp.features
+        for buckets, chunk in zip(self._buckets, fp.bands):
+            bucket = buckets.get(chunk)
+            buckets[chunk] = key if bucket is None else _members(bucket) + (key,)
+
+    def remove(self, key: int):
+        feats = self._features.pop(key, None)
+        if not feats:
+            return
+        for buckets, chunk in zip(self._buckets, band_keys(feats)):
+            rest = tuple(k for k in _members(buckets.get(chunk, ())) if k != key)
+            if not rest:
+                buckets.pop(chunk, None)
+            else:
+                buckets[chunk] = rest[0] if len(rest) == 1 else rest
+
+    def update(self, before, after):
+        """Card aggiunta (before None), cambiata o eliminata (after None): conta solo il testo della domanda."""
+        if before is not None and after is not None and before.question == after.question:
+            return
+        if before is not None:
+            self.remove(before.id)
+        if after is not None:
+            self.add(after.id, after.question)
+
+    def find(self, question: str, fingerprint: Fingerprint | None = None) -> int | None:
+        """La chiave della domanda più simile sopra soglia, se c'è."""
+        fp = fingerprint or Fingerprint(question)
+        feats = fp.features
+        if not feats:
+            return None
+
+        candidates = set()
+        for buckets, chunk in zip(self._buckets, fp.bands):
+            candidates.update(_members(buckets.get(chunk, ())))
+
+        best, best_sim = None, 0.0
+        for key in sorted(candidates):
+            other = self._features.get(key)  # tolta nel frattempo da chi scrive?
+            if other is None:
+                continue
+            sim = jaccard(feats, other)
+            if sim >= DUP_THRESHOLD and sim > best_sim:
+                best, best_sim = key, sim
+        return best
+
+    def clusters(self) -> list[list[int]]:
+        """Gruppi di domande quasi uguali già presenti (solo coppie verificate sopra soglia)."""
+        parent = {}
+
+        def root(k):
+            while parent.get(k, k) != k:
+                k = parent[k]
+            return k
+
+        feats = dict(self._features)
+        for buckets in self._buckets:
+            # copia: chi scrive aggiorna l'indice sul posto mentre lo scorriamo
+            for keys in list(buckets.values()):
+                if not isinstance(keys, tuple):
+                    continue
+                ordered = [k for k in sorted(keys) if k in feats]
+                for i, a in enumerate(ordered):
+                    for b in ordered[i + 1:]:
+                        if root(a) != root(b) and jaccard(feats[a], feats[b]) >= DUP_THRESHOLD:
+                            parent[root(b)] = root(a)
+
+        groups: dict[int, set[int]] = {}
+        for key in set(parent) | set(parent.values()):
+            groups.setdefault(root(key), set()).add(key)
+        return sorted(sorted(g) for g in groups.values() if len(g) > 1)
@@ -0,0 +1,149 @@
+import math
+
+from kb_search import normalize
+
+
+# Parole troppo comuni per dire qualcosa sulla risposta
+STOPWORDS = frozenset("""
+a ad al allo alla ai agli alle all anche che chi ci come con contro cui da dal dallo dalla dai
+dagli dalle dall del dello della dei degli delle dell di e ed essere gli ha hanno il in io la le
+lo loro ma ne negli nei nel nello nella nelle nell non o per piu più quale quali quando quello
+questa questo questi queste se sia si sono su sua sue sui sul sull sulla sulle sugli suo suoi tra fra
+un una uno ogni può puo deve devono cosa cos art
+""".split())
+
+# Prefisso usato come "radice": comune/comuni, locale/locali, consiglio/consiglieri…
+STEM_LEN = 6
+
+# Quante parole chiave dell'Approfondimento considerare (le più rare nella banca)
+MAX_DEEP_TERMS = 20
+
+# La Sintesi pesa il doppio dell'Approfondimento
+SINTESI_WEIGHT = 2.0
+
+
+def terms(text: str) -> dict[str, str]:
+    """Radice → prima parola vista con quella radice (per mostrarla all'utente)."""
+    out = {}
+    for word in normalize(text).split():
+        if len(word) < 3 or word in STOPWORDS or word.isdigit():
+            continue
+        out.setdefault(word[:STEM_LEN], word)
+    return out
+
+
+def _sections(answers) -> tuple[str, str]:
+    """Testo di Sintesi e Approfondimento (senza le etichette)."""
+    sintesi = ""
+    approfondimento = ""
+    for a in answers:
+        low = a.lower()
+        if low.startswith("sintesi:"):
+            sintesi = a[len("sintesi:"):]
+        elif low.startswith("approfondimento:"):
+            approfondimento = a[len("approfondimento:"):]
+    return sintesi, approfondimento
+
+
+class CardKey:
+    """Parole chiave di una card con il loro peso."""
+
+    __slots__ = ("weights", "words", "total")
+
+    def __init__(self, weights: dict[str, float], words: dict[str, str]):
+        self.weights = weights
+        self.words = words
+        self.total = sum(weights.values())
+
+
+class Grader:
+    """
+    Valuta le risposte del quiz contro Sintesi e Approfondimento delle domande della banca.
+    Il peso di una parola chiave è la sua rarità nella banca (idf): "comune" conta poco,
+    "peculato" molto. Le statistiche (df) si aggiornano card per card con add/remove/update,
+    le parole chiave di ogni card si estraggono al primo uso e restano in cache,
+    i pesi si calcolano al momento (costano quanto la card).
+    """
+
+    def __init__(self, cards=()):
+        self.n = 0
+        self.df: dict[str, int] = {}
+        self._terms: dict[int, tuple[object, dict[str, str], dict[str, str]]] = {}
+        for card in cards:
+            self.add(card)
+
+    @staticmethod
+    def _stems(card) -> dict[str, str]:
+        sintesi, approfondimento = _sections(card.answers)
+        return terms(sintesi + " " + approfondimento)
+
+    def add(self, card):
+        """Conta le parole chiave di una card nuova nelle statistiche."""
+        self.n += 1
+        for stem in self._stems(card):
+            self.df[stem] = self.df.get(stem, 0) + 1
+
+    def remove(self, card):
+        """Toglie dalle statistiche una card eliminata (o nella versione di prima)."""
+        self.n -= 1
+        for stem in self._stems(card):
+            left = self.df.get(stem, 0) - 1
+            if left > 0:
+                self.df[stem] = left
+            else:
+                self.df.pop(stem, None)
+        self._terms.pop(card.id, None)
+
+    def update(self, before, after):
+        """Card aggiunta (before None), cambiata o eliminata (after None)."""
+        if before is not None and after is not None and _sections(before.answers) == _sections(after.answers):
+            self._terms.pop(before.id, None)  # es. una risposta libera in più
+            return
+        if before is not None:
+            self.remove(before)
+        if after is not None:
+            self.add(after)
+
+    def idf(self, stem: str) -> float:
+        df = self.df.get(stem, 0)
+        return math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+
+    def key(self, card) -> CardKey:
+        cached = self._terms.get(card.id)
+        if cached is None or cached[0] is not card:
+            sintesi, approfondimento = _sections(card.answers)
+            if not sintesi and not approfondimento:
+                # card imparata in chat: niente etichette, usiamo tutto il testo
+                sintesi = " ".join(card.answers)
+            cached = (card, terms(sintesi), terms(approfondimento))
+            self._terms[card.id] = cached
+        _, main, deep = cached
+
+        weights = {}
+        words = dict(main)
+        for stem in main:
+            weights[stem] = SINTESI_WEIGHT * self.idf(stem)
+
+        ranked = sorted((s for s in deep if s not in weights), key=self.idf, reverse=True)
+        for stem in ranked[:MAX_DEEP_TERMS]:
+            weights[stem] = self.idf(stem)
+            words[stem] = deep[stem]
+        return CardKey(weights, words)
+
+    def grade(self, card, answer: str) -> tuple[int, list[str]]:
+        """
+        Percentuale di copertura delle parole chiave (pesata) e
+        le parole chiave più importanti che mancano nella risposta.
+        """
+        key = self.key(card)
+        if not key.total:
+            return 0, []
+
+        given = terms(answer)
+        covered = sum(w for stem, w in key.weights.items() if stem in given)
+        missing = sorted(
+            (stem for stem in key.weights if stem not in given),
+            key=key.weights.get,
+            reverse=True,
+        )
+        return round(100 * covered / key.total), [key.words[stem] for stem in missing[:5]]
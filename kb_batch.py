@@ -0,0 +1,181 @@
+"""
+Risoluzione in blocco di domande, senza Telegram: lo stesso matcher del bot
+(main2.find_best_match + main2.format_answer_from_list) su un file JSONL di richieste,
+in parallelo su tutti i core, con i risultati scritti riga per riga man mano che arrivano.
+
+    python kb_batch.py richieste.jsonl                         → risultati su stdout
+    python kb_batch.py richieste.jsonl -o risultati.jsonl --bank diritto
+    python kb_batch.py requests.jsonl --field title --engine semantic --no-answers
+
+Ogni riga del file è una stringa JSON ("Cos'è il TUEL?") oppure un oggetto: la domanda è
+nel campo --field (di default il primo tra query, question, text). Ogni riga in uscita è
+{"line": ..., "query": ..., "match": domanda trovata o null, "answer": risposta formattata}
+nello stesso ordine dell'ingresso: due esecuzioni con --engine diversi si confrontano con diff.
+
+Motori (--engine):
+- full:     quello del bot (parole chiave, risposte, fuzzy e poi per significato)
+- keyword:  solo parole chiave, risposte e fuzzy (kb_search.match_shards)
+- semantic: solo la ricerca per significato (semantic.SemanticIndex)
+
+Alla fine scrive su stderr quante richieste ha risolto e quante al secondo.
+Non serve il TOKEN: il bot non viene avviato.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from kb_search import match_shards
+from kb_store import DEFAULT_BANK, BANK_NAME_RE, BankManager
+from main2 import find_best_match, format_answer_from_list, get_answer_for_question, scatter_for
+
+# Campi in cui cercare la domanda, se non si indica --field
+QUERY_FIELDS = ("query", "question", "text")
+
+# Richieste mandate insieme a un worker: abbastanza da non pagare il viaggio per ognuna
+CHUNK = 64
+
+ENGINES = ("full", "keyword", "semantic")
+
+# Banca aperta da ogni worker (vedi _open_bank)
+_bank = None
+
+
+def _open_bank(db: str, banks_dir: str, name: str):
+    """Inizializzatore dei worker: ognuno carica la banca una volta sola."""
+    global _bank
+    _bank = BankManager(db, banks_dir, memory_budget=sys.maxsize).get(name)
+
+
+def resolve(bank, query: str, engine: str) -> str | None:
+    """La domanda della banca che risponde a query, secondo il motore scelto."""
+    # come handle_message: il fuzzy match distingue le maiuscole, il bot cerca il testo in minuscolo
+    query = query.lower()
+    if engine == "full":
+        return find_best_match(query, bank)
+    snap = bank.snapshot
+    if engine == "keyword":
+        card_id, _ = match_shards(scatter_for(bank, snap), query)
+    else:
+        card_id = snap.semantic.best(query)
+    card = snap.get(card_id) if card_id is not None else None
+    return card.question if card else None
+
+
+def resolve_chunk(chunk: list[tuple[int, str]], engine: str, answers: bool) -> list[dict]:
+    """Risolve un blocco di richieste (numero di riga, domanda) sulla banca del worker."""
+    out = []
+    for line, query in chunk:
+        match = resolve(_bank, query, engine)
+        record = {"line": line, "query": query, "match": match}
+        if answers:
+            record["answer"] = format_answer_from_list(list(get_answer_for_question(match, _bank))) if match else None
+        out.append(record)
+    return out
+
+
+def read_queries(stream, field: str | None):
+    """(numero di riga, domanda) per ogni riga del JSONL; le righe senza domanda si saltano con un avviso."""
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            item = json.loads(text)
+        except ValueError as e:
+            print(f"⚠️ Riga {line}: JSON non valido ({e})", file=sys.stderr)
+            continue
+        if isinstance(item, dict):
+            fields = (field,) if field else QUERY_FIELDS
+            item = next((item[f] for f in fields if isinstance(item.get(f), str)), None)
+        if not isinstance(item, str) or not item.strip():
+            print(f"⚠️ Riga {line}: nessuna domanda", file=sys.stderr)
+            continue
+        yield line, item.strip()
+
+
+def chunked(items, size: int):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_batch(chunks, pool, engine: str, answers: bool, window: int):
+    """
+    I risultati dei blocchi, nell'ordine dell'ingresso, man mano che sono pronti.
+    Al massimo window blocchi in volo: il file si legge mentre si risolve, non tutto all'inizio.
+    """
+    if pool is None:
+        for chunk in chunks:
+            yield resolve_chunk(chunk, engine, answers)
+        return
+
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(resolve_chunk, chunk, engine, answers))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Risolve in blocco un file JSONL di domande, senza avviare il bot.")
+    parser.add_argument("file", help="JSONL di richieste (- per stdin)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL dei risultati (default: stdout)")
+    parser.add_argument("--field", help=f"campo con la domanda (default: il primo tra {', '.join(QUERY_FIELDS)})")
+    parser.add_argument("--engine", choices=ENGINES, default="full", help="motore di ricerca (default: full)")
+    parser.add_argument("--no-answers", action="store_true", help="solo la domanda trovata, senza la risposta")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processi (default: uno per core; 0 = tutto in questo processo)")
+    parser.add_argument("--bank", default=DEFAULT_BANK, help="nome della banca (default: db)")
+    parser.add_argument("--db", default="db.json", help="file della banca di default")
+    parser.add_argument("--banks-dir", default=os.getenv("BANKS_DIR", "banks"))
+    args = parser.parse_args(argv)
+
+    if not BANK_NAME_RE.match(args.bank):
+        parser.error("nome della banca non valido")
+
+    source = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8-sig")
+    sink = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+
+    pool = None
+    if args.workers > 0:
+        pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_open_bank,
+                                   initargs=(args.db, args.banks_dir, args.bank))
+    else:
+        _open_bank(args.db, args.banks_dir, args.bank)
+
+    start = time.perf_counter()
+    total = found = 0
+    try:
+        chunks = chunked(read_queries(source, args.field), CHUNK)
+        for records in run_batch(chunks, pool, args.engine, not args.no_answers, max(args.workers, 1) * 4):
+            for record in records:
+                sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                found += record["match"] is not None
+            total += len(records)
+            sink.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else 0.0
+    print(f"✅ {total} domande in {elapsed:.2f} s ({rate:.0f}/s), {found} con risposta", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Importazione in blocco di domande in una banca.
+
+    python kb_import.py domande.csv               → nella banca di default (db.json)
+    python kb_import.py esame.md --bank diritto   → in banks/diritto.json
+    python kb_import.py domande.jsonl --dry-run   → controlla soltanto, non salva
+    python kb_import.py db-20260101-120000.delta.json.gz   → riapplica un /backup delta
+
+Formati (scelti dall'estensione, o con --format):
+- CSV:      colonne question (o domanda), sintesi, approfondimento, collegamenti
+- JSONL:    una domanda per riga, {"question": ..., "answers": [...]}
+            oppure {"question": ..., "sintesi": ..., "approfondimento": ..., "collegamenti": ...}
+- Markdown: "## Domanda" come titolo ("# ..." è il titolo del documento e si ignora),
+            poi le righe "Sintesi: ...", "Approfondimento: ...", "Collegamenti: ..."
+            (anche in grassetto; un paragrafo può continuare sulle righe successive)
+
+Ogni domanda deve avere la Sintesi; Approfondimento e Collegamenti sono facoltativi.
+Le domande già presenti (stesso contenuto) vengono saltate; quelle quasi uguali a una
+esistente (es. "Cos'è il TUEL?" / "cosa è il tuel") le aggiungono solo le parti che le
+mancano. Tutto finisce nella banca con una sola nuova versione e una sola scrittura su file.
+
+Un backup completo (/backup) si ripristina semplicemente decomprimendolo al posto del file
+della banca; i backup incrementali (/backup <password> delta) si riapplicano in ordine su di esso.
+"""
+import argparse
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+
+from dedup import Fingerprint, NearDuplicateIndex
+from kb_search import normalize
+from kb_store import DEFAULT_BANK, BANK_NAME_RE, BankManager
+
+# Etichette ammesse per le risposte, nell'ordine in cui vengono salvate
+LABELS = ("Sintesi", "Approfondimento", "Collegamenti")
+
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".md": "md", ".markdown": "md"}
+
+
+class ImportReport:
+    """Com'è andata un'importazione."""
+
+    def __init__(self):
+        self.added = 0
+        self.attached = 0
+        self.duplicates = 0
+        self.errors: list[tuple[int, str]] = []  # (riga/record, messaggio)
+        self.failed: str | None = None  # file illeggibile: non si è importato nulla
+
+    def summary(self) -> str:
+        if self.failed:
+            return f"❌ Importazione annullata: {self.failed}"
+        text = (
+            f"✅ Importate: {self.added}\n"
+            f"🔗 Unite a domande simili: {self.attached}\n"
+            f"♻️ Duplicate saltate: {self.duplicates}\n"
+            f"⚠️ Scartate: {len(self.errors)}"
+        )
+        for where, message in self.errors[:10]:
+            text += f"\n  - riga {where}: {message}"
+        if len(self.errors) > 10:
+            text += f"\n  - … e altre {len(self.errors) - 10}"
+        return text
+
+
+def content_hash(question: str, answers) -> str:
+    """
+    Impronta del contenuto: uguale per domande identiche a meno di maiuscole e spazi
+    (e, solo nel testo della domanda, della punteggiatura: le risposte sono lunghe
+    e normalizzarle costerebbe più di tutto il resto dell'importazione).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(normalize(question).encode("utf-8"))
+    for a in answers:
+        h.update(b"\x00")
+        h.update(" ".join(a.lower().split()).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _labelled(fields: dict) -> list[str]:
+    """Dai campi sintesi/approfondimento/collegamenti alla lista di risposte etichettate."""
+    answers = []
+    for label in LABELS:
+        value = (fields.get(label.lower()) or "").strip()
+        if value:
+            answers.append(f"{label}: {value}")
+    return answers
+
+
+def _label(answer: str) -> str:
+    return answer.split(":", 1)[0].strip().capitalize()
+
+
+def _missing_parts(existing, answers: list[str]) -> list[str]:
+    """Le risposte con un'etichetta che la domanda esistente non ha ancora."""
+    have = {_label(a) for a in existing}
+    return [a for a in answers if _label(a) not in have]
+
+
+def validate(question: str, answers: list[str]) -> str | None:
+    """Controlla la struttura Sintesi/Approfondimento/Collegamenti. Restituisce l'errore, se c'è."""
+    if not question or not question.strip():
+        return "domanda vuota"
+
+    seen = set()
+    for a in answers:
+        label = _label(a)
+        if ":" not in a or label not in LABELS:
+            return f"risposta senza etichetta valida: {a[:40]!r}"
+        if label in seen:
+            return f"{label} ripetuta"
+        if not a.split(":", 1)[1].strip():
+            return f"{label} vuota"
+        seen.add(label)
+
+    if "Sintesi" not in seen:
+        return "manca la Sintesi"
+    return None
+
+
+def read_csv(stream):
+    for line, row in enumerate(csv.DictReader(stream), 2):
+        row = {(k or "").strip().lower(): v for k, v in row.items()}
+        yield line, row.get("question") or row.get("domanda") or "", _labelled(row)
+
+
+def read_jsonl(stream):
+    for line, raw in enumerate(stream, 1):
+        if not raw.strip():
+            continue
+        try:
+            obj = json.loads(raw)
+        except json.JSONDecodeError as e:
+            yield line, None, f"JSON non valido ({e.msg})"
+            continue
+        if not isinstance(obj, dict):
+            yield line, None, "la riga non è un oggetto JSON"
+            continue
+        answers = obj.get("answers")
+        if answers is None:
+            answers = _labelled({k.lower(): v for k, v in obj.items() if isinstance(v, str)})
+        elif not isinstance(answers, list) or not all(isinstance(a, str) for a in answers):
+            yield line, None, "answers deve essere una lista di testi"
+            continue
+        question = obj.get("question") or obj.get("domanda") or ""
+        if not isinstance(question, str):
+            yield line, None, "question deve essere un testo"
+            continue
+        yield line, question, answers
+
+
+def read_markdown(stream):
+    question = None
+    start = 0
+    answers: list[str] = []
+
+    for line, raw in enumerate(stream, 1):
+        # "**Sintesi:** testo" → "Sintesi: testo"
+        text = raw.replace("**", "").strip()
+        if text.startswith("##"):
+            if question is not None:
+                yield start, question, answers
+            question = text.lstrip("#").strip()
+            start = line
+            answers = []
+        elif not text or text.startswith("#") or question is None:
+            continue
+        elif text.split(":", 1)[0].strip().capitalize() in LABELS and ":" in text:
+            answers.append(text)
+        elif answers:
+            # continuazione del paragrafo precedente
+            answers[-1] += " " + text
+        else:
+            answers.append(text)  # testo fuori etichetta: lo segnalerà validate
+
+    if question is not None:
+        yield start, question, answers
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl, "md": read_markdown}
+
+
+def _readable(records, report: "ImportReport"):
+    """I record del lettore; se il file stesso non si legge, il motivo va in report.failed."""
+    try:
+        yield from records
+    except UnicodeDecodeError:
+        report.failed = "il file non è in UTF-8 (da Excel: Salva con nome → CSV UTF-8)"
+    except csv.Error as e:
+        report.failed = f"CSV non valido ({e})"
+
+
+def detect_format(filename: str) -> str | None:
+    return FORMATS.get(os.path.splitext(filename)[1].lower())
+
+
+def import_stream(bank, stream, fmt: str, dry_run: bool = False) -> ImportReport:
+    """
+    Legge le domande dallo stream (una alla volta), le valida, scarta i duplicati
+    e le aggiunge alla banca tutte insieme. Se il file non si riesce a leggere fino in fondo
+    (non è UTF-8, CSV malformato) non si aggiunge nulla.
+    """
+    report = ImportReport()
+    snap = bank.snapshot
+    seen = {content_hash(c.question, c.answers) for c in snap.cards}
+    batch = []
+    attach: dict[int, list[str]] = {}
+    # quasi-duplicati dentro il file stesso (chiave = posizione nel batch)
+    local = NearDuplicateIndex()
+
+    # ogni lettore produce (riga, domanda, risposte) oppure (riga, None, errore di lettura)
+    for where, question, answers in _readable(READERS[fmt](stream), report):
+        if question is None:
+            report.errors.append((where, answers))
+            continue
+        question = question.strip()
+        answers = [a.strip() for a in answers if a.strip()]
+
+        error = validate(question, answers)
+        if error:
+            report.errors.append((where, error))
+            continue
+
+        digest = content_hash(question, answers)
+        if digest in seen:
+            report.duplicates += 1
+            continue
+        seen.add(digest)
+
+        # quasi uguale a una domanda della banca? le aggiungiamo solo le parti che le mancano
+        fingerprint = Fingerprint(question)  # una volta sola, per la banca e per il file
+        similar = snap.similar(question, fingerprint)
+        if similar is not None:
+            extra = _missing_parts(similar.answers + tuple(attach.get(similar.id, ())), answers)
+            if extra:
+                attach.setdefault(similar.id, []).extend(extra)
+                report.attached += 1
+            else:
+                report.duplicates += 1
+            continue
+
+        # …o a una domanda già letta da questo file?
+        pos = local.find(question, fingerprint)
+        if pos is not None:
+            first_answers = batch[pos][1]
+            extra = _missing_parts(first_answers, answers)
+            if extra:
+                first_answers.extend(extra)
+                report.attached += 1
+            else:
+                report.duplicates += 1
+            continue
+
+        local.add(len(batch), question, fingerprint)
+        batch.append((question, answers))
+
+    if report.failed:
+        return report
+    if (batch or attach) and not dry_run:
+        bank.add_cards(batch, attach)
+    report.added = len(batch)
+    return report
+
+
+def import_bytes(bank, data: bytes, filename: str) -> ImportReport:
+    """Come import_stream, per un file ricevuto dal bot."""
+    fmt = detect_format(filename)
+    if fmt is None:
+        raise ValueError(f"Formato non supportato: {filename}")
+    stream = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", newline="")
+    return import_stream(bank, stream, fmt)
+
+
+def read_delta(bank, data: bytes) -> dict:
+    """Il contenuto di un backup incrementale (gzip), se è di questa banca."""
+    delta = json.loads(gzip.decompress(data))
+    if delta.get("bank") != bank.name:
+        raise ValueError(f"il delta è della banca {delta.get('bank')!r}, non di {bank.name!r}")
+    return delta
+
+
+def apply_delta(bank, data: bytes) -> int:
+    """Riapplica alla banca un backup incrementale (gzip). Restituisce le operazioni applicate."""
+    return bank.apply_ops(read_delta(bank, data).get("ops", []))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa domande in blocco in una banca.")
+    parser.add_argument("file")
+    parser.add_argument("--bank", default=DEFAULT_BANK, help="nome della banca (default: db)")
+    parser.add_argument("--format", choices=sorted(READERS), help="formato del file (default: dall'estensione)")
+    parser.add_argument("--db", default="db.json", help="file della banca di default")
+    parser.add_argument("--banks-dir", default=os.getenv("BANKS_DIR", "banks"))
+    parser.add_argument("--dry-run", action="store_true", help="valida soltanto, non salva")
+    args = parser.parse_args(argv)
+
+    is_delta = args.file.endswith(".delta.json.gz")
+    fmt = args.format or detect_format(args.file)
+    if fmt is None and not is_delta:
+        parser.error("formato non riconosciuto, usa --format")
+    if not BANK_NAME_RE.match(args.bank):
+        parser.error("nome della banca non valido")
+
+    os.makedirs(args.banks_dir, exist_ok=True)
+    bank = BankManager(args.db, args.banks_dir, memory_budget=sys.maxsize).get(args.bank)
+
+    if is_delta:
+        with open(args.file, "rb") as file:
+            data = file.read()
+        try:
+            delta = read_delta(bank, data)
+        except ValueError as e:
+            print(f"❌ {e} (la banca si sceglie con --bank)")
+            return 1
+        # le versioni sono quelle del processo che ha fatto il backup: vanno riapplicati in ordine
+        print(f"📦 Delta della banca {bank.name}: dalla versione {delta.get('base_version')} "
+              f"alla {delta.get('version')}")
+        if args.dry_run:
+            print(f"🔎 Operazioni nel delta: {len(delta.get('ops', []))} (prova: nessuna applicata)")
+            return 0
+        applied = bank.apply_ops(delta.get("ops", []))
+        bank.flush()
+        print(f"✅ Operazioni applicate: {applied}")
+        return 0
+
+    with open(args.file, "r", encoding="utf-8-sig", newline="") as stream:
+        report = import_stream(bank, stream, fmt, dry_run=args.dry_run)
+
+    # il file si scrive in background: usciamo solo quando è su disco
+    bank.flush()
+    print(report.summary())
+    return 1 if report.failed or (report.errors and not report.added) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
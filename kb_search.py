@@ -0,0 +1,421 @@
+import heapq
+import itertools
+import mmap
+import re
+import struct
+import sys
+from bisect import bisect_right
+from difflib import SequenceMatcher
+
+
+# Indice "compilato": tutti i testi di una banca in un unico buffer di byte.
+# Lo stesso formato si usa in RAM (bytes) e condiviso tra processi (mmap su file),
+# così i worker del pool leggono tutti la stessa copia senza deserializzare nulla.
+#
+# Layout:
+#   header    MAGIC (8 byte) + numero di domande (Q) + lunghezza di ogni blob (Q ciascuno)
+#   ids       n ID delle domande (Q)
+#   offsets   per ogni sezione n+1 offset (Q) dentro il suo blob
+#   blobs     per ogni sezione i testi UTF-8 uno dopo l'altro, ognuno chiuso da SEP
+MAGIC = b"EBIX0002"
+
+# sezioni dell'indice
+QUESTION = 0      # testo originale della domanda
+QUESTION_LOW = 1  # domanda in minuscolo (ricerca per parola chiave)
+ANSWERS_LOW = 2   # risposte in minuscolo, separate da ANSWER_SEP
+QUESTION_NORM = 3 # domanda normalizzata come in /questions
+SECTIONS = 4
+
+SEP = b"\x00"
+ANSWER_SEP = b"\x01"
+
+# Somiglianza minima (difflib) per rispondere con una domanda "quasi uguale"…
+FUZZY_CUTOFF = 0.4
+# …e per proporla almeno come suggerimento
+SUGGEST_CUTOFF = 0.3
+
+
+# tutto ciò che non è lettera, cifra o spazio (l'underscore per \w conta come lettera)
+_NOT_WORD = re.compile(r"[^\w\s]|_")
+
+
+def normalize(s: str) -> str:
+    """Minuscolo + punteggiatura "strana" (es. ?, -, , ecc.) trasformata in spazi + niente spazi doppi."""
+    return " ".join(_NOT_WORD.sub(" ", s.lower()).split())
+
+
+def _needle(text: str) -> bytes:
+    """Testo cercato → byte UTF-8, senza i separatori (così non può "scavalcare" due voci)."""
+    return text.encode("utf-8").replace(SEP, b"").replace(ANSWER_SEP, b"")
+
+
+def encode_card(card) -> tuple[bytes, ...]:
+    """Le voci di una card (oggetto con .question e .answers), una per sezione."""
+    text = card.question
+    return (
+        text.encode("utf-8"),
+        _needle(text.lower()),
+        ANSWER_SEP.join(_needle(a.lower()) for a in card.answers),
+        _needle(normalize(text)),
+    )
+
+
+def compile_index(cards) -> bytes:
+    """Costruisce il buffer dell'indice a partire dalle card (oggetti con .id, .question e .answers)."""
+    return pack_index([(card.id, encode_card(card)) for card in cards])
+
+
+def pack_index(entries: list[tuple[int, tuple[bytes, ...]]]) -> bytes:
+    """Costruisce il buffer dell'indice da voci già codificate: (ID, voci come da encode_card)."""
+    n = len(entries)
+    offsets = []
+    blobs = []
+    for section in range(SECTIONS):
+        items = [entry[section] for _, entry in entries]
+        pos = 0
+        offs = [0]
+        for item in items:
+            pos += len(item) + 1
+            offs.append(pos)
+        offsets.append(struct.pack(f"<{n + 1}Q", *offs))
+        blobs.append(SEP.join(items) + SEP if items else b"")
+
+    header = MAGIC + struct.pack(f"<Q{SECTIONS}Q", n, *(len(b) for b in blobs))
+    ids = struct.pack(f"<{n}Q", *(card_id for card_id, _ in entries))
+    return header + ids + b"".join(offsets) + b"".join(blobs)
+
+
+_tokens = itertools.count()
+
+
+class CompiledIndex:
+    """Vista in sola lettura su un buffer creato da compile_index (bytes o mmap)."""
+
+    def __init__(self, buf):
+        if buf[:len(MAGIC)] != MAGIC:
+            raise ValueError("Indice non valido")
+        self.buf = buf
+        pos = len(MAGIC)
+        self.n, *blob_lens = struct.unpack_from(f"<Q{SECTIONS}Q", buf, pos)
+        pos += 8 * (SECTIONS + 1)
+
+        view = memoryview(buf)
+        self.ids = view[pos:pos + 8 * self.n].cast("Q")
+        pos += 8 * self.n
+
+        self._offsets = []
+        for _ in range(SECTIONS):
+            size = 8 * (self.n + 1)
+            self._offsets.append(view[pos:pos + size].cast("Q"))
+            pos += size
+
+        self._bounds = []
+        for length in blob_lens:
+            self._bounds.append((pos, pos + length))
+            pos += length
+
+        self._questions = None
+        # identifica questo indice (es. il suo file condiviso con i worker) finché esiste
+        self.token = next(_tokens)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def text(self, section: int, i: int) -> str:
+        start = self._bounds[section][0]
+        offs = self._offsets[section]
+        return bytes(self.buf[start + offs[i]:start + offs[i + 1] - 1]).decode("utf-8")
+
+    def entry(self, i: int) -> tuple[bytes, ...]:
+        """Le voci (byte) della domanda in posizione i, come da encode_card."""
+        out = []
+        for section in range(SECTIONS):
+            start = self._bounds[section][0]
+            offs = self._offsets[section]
+            out.append(bytes(self.buf[start + offs[i]:start + offs[i + 1] - 1]))
+        return tuple(out)
+
+    def questions(self) -> list[str]:
+        """Testi originali delle domande (decodificati una volta sola)."""
+        if self._questions is None:
+            self._questions = [self.text(QUESTION, i) for i in range(self.n)]
+        return self._questions
+
+    def hits(self, section: int, needle: bytes) -> list[int]:
+        """Posizioni (in ordine) delle voci della sezione che contengono needle."""
+        if not needle:
+            return list(range(self.n))
+
+        start, end = self._bounds[section]
+        offs = self._offsets[section]
+        out = []
+        pos = self.buf.find(needle, start, end)
+        while pos != -1:
+            i = bisect_right(offs, pos - start) - 1
+            out.append(i)
+            # una voce conta una volta sola: ripartiamo dalla successiva
+            pos = self.buf.find(needle, start + offs[i + 1], end)
+        return out
+
+
+# Score massimo di una domanda trovata solo nelle risposte (3 - lunghezza/200):
+# se una domanda trovata nel testo arriva almeno qui, le risposte non serve nemmeno guardarle
+STRONG_HIT = 3.0
+
+_NOTHING = frozenset()
+
+
+def _entry_has(index: CompiledIndex, section: int, i: int, needle: bytes) -> bool:
+    start = index._bounds[section][0]
+    offs = index._offsets[section]
+    return index.buf.find(needle, start + offs[i], start + offs[i + 1] - 1) != -1
+
+
+def _score(index: CompiledIndex, i: int, points: int) -> float:
+    # preferisci domande corte per definizioni (es. "Cos'è il TUEL?")
+    return points - len(index.text(QUESTION_LOW, i)) / 200.0
+
+
+def question_scan(index: CompiledIndex, user: str, skip=_NOTHING) -> tuple[float, int] | None:
+    """
+    Migliore (score, ID) tra le domande che contengono il testo cercato:
+    5 punti, più 3 se compare anche nelle sue risposte (controllate solo per queste domande).
+    Le domande con ID in skip non contano (vedi ShardSet).
+    """
+    needle = _needle(user)
+    best = None
+    for i in index.hits(QUESTION_LOW, needle):
+        if index.ids[i] in skip:
+            continue
+        score = _score(index, i, 8 if _entry_has(index, ANSWERS_LOW, i, needle) else 5)
+        if best is None or score > best[0]:
+            best = (score, index.ids[i])
+    return best
+
+
+def answer_scan(index: CompiledIndex, user: str, skip=_NOTHING) -> tuple[float, int] | None:
+    """Migliore (score, ID) tra le domande trovate solo nelle risposte (3 punti)."""
+    needle = _needle(user)
+    in_question = set(index.hits(QUESTION_LOW, needle))
+    best = None
+    for i in index.hits(ANSWERS_LOW, needle):
+        if i in in_question or index.ids[i] in skip:
+            continue
+        score = _score(index, i, 3)
+        if best is None or score > best[0]:
+            best = (score, index.ids[i])
+    return best
+
+
+def fuzzy_scan(index: CompiledIndex, user_question: str, k: int, cutoff: float,
+               skip=_NOTHING) -> list[tuple[float, str, int]]:
+    """
+    Le k domande più simili (somiglianza, testo, -ID), con gli stessi controlli
+    e lo stesso ordine di difflib.get_close_matches (a parità vince la prima).
+    """
+    heap: list[tuple[float, str, int]] = []
+    matcher = SequenceMatcher()
+    matcher.set_seq2(user_question)
+    for i, text in enumerate(index.questions()):
+        matcher.set_seq1(text)
+        if (matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff
+                and matcher.ratio() >= cutoff and index.ids[i] not in skip):
+            item = (matcher.ratio(), text, -index.ids[i])
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return heap
+
+
+def match_shards(scatter, user_question: str, k: int = 0) -> tuple[int | None, list[tuple[int, float]]]:
+    """
+    Ricerca su una banca divisa in shard (ognuno con il suo indice), con lo stesso risultato
+    di una ricerca su un indice unico. scatter(fn, *args) esegue fn(shard, *args) su ogni
+    shard, anche in parallelo, e restituisce i risultati.
+
+    Prima si cercano le domande (testo corto, veloce); solo se nessuna arriva a STRONG_HIT
+    si passa al testo delle risposte, e solo se non c'è proprio nulla al fuzzy match.
+    A parità vince la domanda inserita prima, cioè quella con l'ID più basso.
+    """
+    user = user_question.lower().strip()
+
+    def pick(best, results):
+        # score più alto (e > 0); a parità l'ID più basso
+        for found in results:
+            if found is not None and found[0] > 0:
+                key = (found[0], -found[1])
+                if best is None or key > best:
+                    best = key
+        return best
+
+    best = pick(None, scatter(question_scan, user))
+    if best is None or best[0] < STRONG_HIT:
+        best = pick(best, scatter(answer_scan, user))
+
+    # Se abbiamo trovato qualcosa con score > 0, usiamo quello
+    if best is not None:
+        return -best[1], []
+
+    # Se proprio nulla, usiamo fuzzy match sul testo delle domande
+    cutoff = SUGGEST_CUTOFF if k else FUZZY_CUTOFF
+    ranked = heapq.nlargest(max(k, 1), (item for items in scatter(fuzzy_scan, user_question, max(k, 1), cutoff)
+                                        for item in items))
+    if ranked and ranked[0][0] >= FUZZY_CUTOFF:
+        return -ranked[0][2], []
+    return None, [(-neg_id, score) for score, _, neg_id in ranked[:k]]
+
+
+def filter_questions(index: CompiledIndex, terms: list[str], skip=_NOTHING) -> list[int]:
+    """ID (in ordine) delle domande che contengono (normalizzati) tutti i termini."""
+    selected = None
+    for term in terms:
+        if not term:
+            continue
+        found = set(index.hits(QUESTION_NORM, _needle(term)))
+        selected = found if selected is None else selected & found
+    ids = index.ids if selected is None else (index.ids[i] for i in sorted(selected))
+    return [card_id for card_id in ids if card_id not in skip]
+
+
+# Domande cambiate dopo l'ultima rifusione oltre le quali conviene rifondere gli shard
+TAIL_MAX = 512
+
+
+class ShardSet:
+    """
+    L'indice di ricerca di una versione della banca, aggiornabile senza ricompilarlo:
+    - shards: indici compilati (come da compile_index), in ordine di ID
+    - masked: ID che negli shard non valgono più (domande eliminate o cambiate)
+    - tail: ID → (voci come da encode_card, True se l'ID è anche negli shard) delle domande
+      aggiunte o cambiate dopo l'ultima rifusione, compilate in un piccolo indice a parte
+    Aggiungere, cambiare o eliminare una domanda costa quanto la card (più la coda, che resta
+    piccola): quando la coda supera TAIL_MAX la si rifonde negli shard, in background.
+    Come la Snapshot, un ShardSet non cambia mai: updated ne restituisce uno nuovo.
+    """
+
+    __slots__ = ("shards", "masked", "tail", "_tail_index")
+
+    def __init__(self, shards: tuple[CompiledIndex, ...], masked: frozenset[int] = _NOTHING,
+                 tail: dict[int, tuple[tuple[bytes, ...], bool]] | None = None):
+        self.shards = shards
+        self.masked = masked
+        self.tail = tail or {}
+        self._tail_index = None
+
+    @classmethod
+    def build(cls, cards, shard_size: int) -> "ShardSet":
+        cards = list(cards)
+        return cls(tuple(
+            CompiledIndex(compile_index(cards[start:start + shard_size]))
+            for start in range(0, max(len(cards), 1), shard_size)
+        ))
+
+    @property
+    def segments(self) -> list[tuple[CompiledIndex, frozenset[int]]]:
+        """(indice, ID da saltare) di ogni pezzo da cercare: gli shard e poi la coda."""
+        out = [(shard, self.masked) for shard in self.shards]
+        if self.tail:
+            if self._tail_index is None:
+                entries = sorted((card_id, entry) for card_id, (entry, _) in self.tail.items())
+                self._tail_index = CompiledIndex(pack_index(entries))
+            out.append((self._tail_index, _NOTHING))
+        return out
+
+    @property
+    def nbytes(self) -> int:
+        """Byte occupati: gli indici compilati più gli ID mascherati (la coda resta piccola, non si conta)."""
+        return sum(len(shard.buf) for shard in self.shards) + sys.getsizeof(self.masked)
+
+    def updated(self, changes) -> "ShardSet":
+        """
+        Nuovo ShardSet dopo le modifiche (ID, card di prima o None se nuova, card di adesso
+        o None se eliminata): solo le card cambiate vengono codificate.
+        """
+        masked = set(self.masked)
+        tail = dict(self.tail)
+        for card_id, before, after in changes:
+            # un ID che non è in coda è negli shard, a meno che la domanda non sia nuova
+            queued = tail.pop(card_id, None)
+            in_shards = queued[1] if queued is not None else before is not None
+            if in_shards:
+                masked.add(card_id)
+            if after is not None:
+                tail[card_id] = (encode_card(after), in_shards)
+        return ShardSet(self.shards, frozenset(masked), tail)
+
+    def needs_fold(self) -> bool:
+        return len(self.tail) > TAIL_MAX or len(self.masked) > TAIL_MAX
+
+    def folded(self, shard_size: int) -> "ShardSet":
+        """
+        Rifonde la coda negli shard (pensata per girare in background): si ricompongono
+        solo gli shard con ID mascherati, copiando le voci già codificate, più l'ultimo
+        se ci sono domande nuove.
+        """
+        fresh = sorted((card_id, entry) for card_id, (entry, in_shards) in self.tail.items() if not in_shards)
+        shards = list(self.shards)
+        for n, shard in enumerate(shards):
+            last = n == len(shards) - 1
+            if self.masked.isdisjoint(shard.ids) and not (last and fresh):
+                continue
+            entries = []
+            for i, card_id in enumerate(shard.ids):
+                if card_id not in self.masked:
+                    entries.append((card_id, shard.entry(i)))
+                elif card_id in self.tail:
+                    entries.append((card_id, self.tail[card_id][0]))
+            if last:
+                entries.extend(fresh)
+            shards[n] = [entries[start:start + shard_size] for start in range(0, len(entries), shard_size)]
+
+        out = []
+        for shard in shards:
+            if isinstance(shard, CompiledIndex):
+                out.append(shard)
+            else:
+                out.extend(CompiledIndex(pack_index(entries)) for entries in shard)
+        return ShardSet(tuple(out) or (CompiledIndex(pack_index([])),))
+
+    def rebased(self, base: "ShardSet", current: "ShardSet") -> "ShardSet":
+        """
+        Questo ShardSet (base rifuso) con sopra le modifiche arrivate durante la rifusione,
+        cioè quelle che hanno portato da base a current.
+        """
+        masked = set(current.masked - base.masked)
+        tail = {}
+        for card_id, item in current.tail.items():
+            before = base.tail.get(card_id)
+            if before is item:
+                continue  # già negli shard rifusi
+            if before is not None:
+                item = (item[0], True)
+            tail[card_id] = item
+        # cambiate o eliminate dopo essere finite negli shard rifusi
+        masked.update(card_id for card_id, item in base.tail.items() if current.tail.get(card_id) is not item)
+        return ShardSet(self.shards, frozenset(masked), tail)
+
+
+# --- Worker del pool di processi ---
+# Ogni worker apre i file degli indici in mmap e li tiene in cache per path:
+# il kernel condivide le stesse pagine tra tutti i processi. Un file non cambia mai
+# (un indice nuovo ha un file nuovo), quindi basta tenere gli ultimi MAX_OPEN aperti.
+MAX_OPEN = 64
+_shared: dict[str, CompiledIndex] = {}
+
+
+def open_shared(path: str) -> CompiledIndex:
+    index = _shared.pop(path, None)
+    if index is None:
+        with open(path, "rb") as file:
+            mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        index = CompiledIndex(mm)
+        while len(_shared) >= MAX_OPEN:
+            del _shared[next(iter(_shared))]
+    _shared[path] = index  # in fondo: il meno usato di recente è il primo
+    return index
+
+
+def run_shared(fn, path: str, *args):
+    """Esegue fn(indice, *args) nel worker, sull'indice condiviso nel file indicato."""
+    return fn(open_shared(path), *args)
@@ -0,0 +1,950 @@
+import atexit
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+
+from dedup import Fingerprint, NearDuplicateIndex
+from grading import Grader
+from kb_search import ShardSet
+from related import RelatedGraph
+from semantic import SemanticIndex
+
+
+# Nome della banca di default (quella storica, su db.json)
+DEFAULT_BANK = "db"
+
+# I nomi delle banche diventano nomi di file: niente slash o caratteri strani
+BANK_NAME_RE = re.compile(r"^[a-z0-9_-]{1,40}$")
+
+# RAM per domanda di una banca caricata e "scaldata" (Bank.warm), oltre ai testi compressi
+# nell'arena: misurata con tracemalloc su banche da 5.000 e 20.000 domande. L'indice di ricerca
+# e i vettori, una volta costruiti, si misurano direttamente (nbytes); le strutture fatte di
+# dizionari e set si contano con questi valori. Una banca da 5.000 domande (file da 6 MB)
+# occupa circa 43 MB.
+CARD_BYTES = {
+    "cards": 500,  # Card, testo della domanda, Slots e by_id
+    "shards": 1300,
+    "questions": 200,
+    "grader": 20,
+    "near_duplicates": 1500,
+    "related": 2000,
+    "semantic": 2300,
+}
+
+# Le risposte più lunghe di così si tengono compresse nell'arena (in pratica tutte tranne le brevi)
+LONG_ANSWER = 64
+# Quanto testo delle risposte lunghe usare come dizionario di zlib
+ZDICT_SIZE = 16 * 1024
+
+# Domande per shard dell'indice di ricerca: le banche enormi si cercano shard per shard,
+# in parallelo sul pool di processi
+SHARD_SIZE = 100_000
+
+# Dove scrivere gli indici condivisi con i worker: /dev/shm è già RAM condivisa
+SHARED_INDEX_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+KEEP_SHARED_VERSIONS = 3
+
+# Card per blocco di Slots: cambiare o aggiungere una card copia un blocco, non tutta la banca
+SLOTS_BLOCK = 1024
+
+# Compattazione in background quando le lapidi sono almeno tante e almeno il 10% delle domande
+COMPACT_MIN_DELETED = 64
+
+# Operazioni tenute per il backup incrementale: oltre, il prossimo backup sarà completo
+MAX_BACKUP_OPS = 50_000
+
+# Strutture costruite al primo uso: nome della proprietà di Snapshot → attributo in cui sta
+STRUCTURES = {
+    "shards": "_shards",
+    "questions": "_questions",
+    "grader": "_grader",
+    "near_duplicates": "_dups",
+    "related": "_related",
+    "semantic": "_semantic",
+}
+
+# Una costruzione alla volta: chi chiede una struttura che un altro thread sta già
+# costruendo aspetta quella, invece di costruirne una seconda
+_build_lock = threading.Lock()
+
+
+def load_knowledge_base(path: str) -> dict:
+    """Carica la knowledge base da un file JSON."""
+    if not os.path.exists(path):
+        return {"questions": []}
+
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return {"questions": []}
+
+
+def save_knowledge_base(data: dict, path: str):
+    """
+    Salva la knowledge base nel file JSON locale.
+    Scrive su un file temporaneo e lo rinomina: chi legge il file vede sempre
+    la versione vecchia o quella nuova, mai una a metà.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class TextArena:
+    """
+    I testi lunghi di una banca, compressi uno dopo l'altro in un unico bytearray.
+    Ogni testo si comprime da solo (con un dizionario comune preso dalla banca
+    stessa, così anche i testi brevi comprimono bene) e si ritrova con un handle
+    intero: offset << 32 | lunghezza compressa.
+    Si scrive solo in coda, quindi gli handle restano validi per tutte le versioni.
+    """
+
+    def __init__(self, zdict: bytes = b""):
+        self._buf = bytearray()
+        self._zdict = zdict
+
+    @classmethod
+    def for_texts(cls, texts) -> "TextArena":
+        """Arena con un dizionario fatto dai primi testi lunghi (zlib guarda soprattutto la fine del dizionario)."""
+        sample = []
+        size = 0
+        for text in texts:
+            if len(text) > LONG_ANSWER and size < ZDICT_SIZE:
+                sample.append(text.encode("utf-8"))
+                size += len(sample[-1])
+        return cls(b"".join(reversed(sample))[-ZDICT_SIZE:])
+
+    def __len__(self) -> int:
+        return len(self._buf)
+
+    def empty_copy(self) -> "TextArena":
+        """Arena vuota con lo stesso dizionario (per ricopiarci dentro solo i testi vivi)."""
+        return TextArena(self._zdict)
+
+    def put(self, text: str) -> int:
+        comp = zlib.compressobj(9, zdict=self._zdict) if self._zdict else zlib.compressobj(9)
+        return self.put_raw(comp.compress(text.encode("utf-8")) + comp.flush())
+
+    def put_raw(self, data: bytes) -> int:
+        handle = len(self._buf) << 32 | len(data)
+        self._buf += data
+        return handle
+
+    def raw(self, handle: int) -> bytes:
+        start = handle >> 32
+        return bytes(self._buf[start:start + (handle & 0xFFFFFFFF)])
+
+    def get(self, handle: int) -> str:
+        decomp = zlib.decompressobj(zdict=self._zdict) if self._zdict else zlib.decompressobj()
+        return (decomp.decompress(self.raw(handle)) + decomp.flush()).decode("utf-8")
+
+
+class Card:
+    """
+    Una domanda con le sue risposte e il suo ID stabile (non cambia mai, nemmeno
+    se si eliminano altre domande).
+    È immutabile: per cambiarla se ne crea una nuova, così chi sta leggendo
+    una versione precedente della banca non la vede cambiare sotto i piedi.
+
+    Il testo della domanda è internato; le risposte lunghe stanno compresse
+    nell'arena della banca (in _answers c'è il loro handle) e si decomprimono
+    solo quando servono, cioè quando la card viene mostrata.
+    """
+
+    __slots__ = ("id", "question", "_answers", "_arena")
+
+    def __init__(self, card_id: int, question: str, answers, arena: TextArena | None = None):
+        self.id = card_id
+        self.question = sys.intern(question)
+        self._arena = arena
+        self._answers = tuple(self._pack(a) for a in answers)
+
+    def _pack(self, answer: str) -> str | int:
+        if self._arena is not None and len(answer) > LONG_ANSWER:
+            return self._arena.put(answer)
+        return answer
+
+    @property
+    def answers(self) -> tuple[str, ...]:
+        return tuple(a if isinstance(a, str) else self._arena.get(a) for a in self._answers)
+
+    def _copy(self, packed: tuple, arena: TextArena | None) -> "Card":
+        card = Card.__new__(Card)
+        card.id = self.id
+        card.question = self.question
+        card._answers = packed
+        card._arena = arena
+        return card
+
+    def with_answer(self, answer: str) -> "Card":
+        """Nuova card con una risposta in più (le altre restano compresse come sono)."""
+        return self._copy(self._answers + (self._pack(answer),), self._arena)
+
+    def moved_to(self, arena: TextArena) -> "Card":
+        """La stessa card, con i testi compressi ricopiati (senza ricomprimerli) in un'altra arena."""
+        packed = tuple(a if isinstance(a, str) else arena.put_raw(self._arena.raw(a)) for a in self._answers)
+        return self._copy(packed, arena)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "question": self.question, "answers": list(self.answers)}
+
+
+class Slots:
+    """
+    Sequenza immutabile di Card divisa in blocchi da SLOTS_BLOCK: si legge come una tupla,
+    ma la versione con una card cambiata (o aggiunta in fondo) condivide con la precedente
+    tutti i blocchi tranne uno.
+    """
+
+    __slots__ = ("_blocks", "_len")
+
+    def __init__(self, cards=(), blocks: tuple[tuple[Card, ...], ...] | None = None):
+        if blocks is None:
+            cards = tuple(cards)
+            blocks = tuple(cards[start:start + SLOTS_BLOCK] for start in range(0, len(cards), SLOTS_BLOCK))
+        self._blocks = blocks
+        self._len = sum(len(block) for block in blocks)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, pos: int) -> Card:
+        if not 0 <= pos < self._len:
+            raise IndexError(pos)
+        block, offset = divmod(pos, SLOTS_BLOCK)
+        return self._blocks[block][offset]
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def replaced(self, pos: int, card: Card) -> "Slots":
+        """Nuova sequenza con card al posto di quella in posizione pos."""
+        n, offset = divmod(pos, SLOTS_BLOCK)
+        block = self._blocks[n]
+        blocks = list(self._blocks)
+        blocks[n] = block[:offset] + (card,) + block[offset + 1:]
+        return Slots(blocks=tuple(blocks))
+
+    def appended(self, cards) -> "Slots":
+        """Nuova sequenza con le card aggiunte in fondo."""
+        cards = tuple(cards)
+        blocks = list(self._blocks)
+        if blocks and len(blocks[-1]) < SLOTS_BLOCK:
+            room = SLOTS_BLOCK - len(blocks[-1])
+            blocks[-1] += cards[:room]
+            cards = cards[room:]
+        blocks.extend(cards[start:start + SLOTS_BLOCK] for start in range(0, len(cards), SLOTS_BLOCK))
+        return Slots(blocks=tuple(blocks))
+
+
+class Tombstones:
+    """
+    Insieme immutabile degli ID eliminati, diviso in blocchi da SLOTS_BLOCK ID (come Slots):
+    la versione con una lapide in più condivide con la precedente tutti i blocchi tranne uno,
+    così un'eliminazione non copia tutte le lapidi accumulate fino alla compattazione.
+    """
+
+    __slots__ = ("_blocks", "_len")
+
+    def __init__(self, blocks: dict[int, frozenset[int]] | None = None, length: int | None = None):
+        self._blocks = blocks or {}
+        self._len = sum(len(block) for block in self._blocks.values()) if length is None else length
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __contains__(self, card_id: int) -> bool:
+        block = self._blocks.get(card_id // SLOTS_BLOCK)
+        return block is not None and card_id in block
+
+    def __iter__(self):
+        for block in self._blocks.values():
+            yield from block
+
+    def added(self, card_id: int) -> "Tombstones":
+        """Nuovo insieme con card_id in più."""
+        if card_id in self:
+            return self
+        n = card_id // SLOTS_BLOCK
+        blocks = dict(self._blocks)
+        blocks[n] = blocks.get(n, frozenset()) | {card_id}
+        return Tombstones(blocks, self._len + 1)
+
+
+class QuestionIndex:
+    """Testo della domanda (senza maiuscole) → ID, per trovare una domanda senza scorrere la banca."""
+
+    def __init__(self, cards=()):
+        self._ids: dict[str, list[int]] = {}
+        for card in cards:
+            self.update(None, card)
+
+    def update(self, before, after):
+        """Card aggiunta (before None), cambiata o eliminata (after None)."""
+        if before is not None and after is not None and before.question == after.question:
+            return
+        if before is not None:
+            ids = self._ids.get(before.question.lower())
+            if ids and before.id in ids:
+                # una lista nuova: chi legge può stare scorrendo quella vecchia
+                self._ids[before.question.lower()] = [i for i in ids if i != before.id]
+        if after is not None:
+            low = after.question.lower()
+            self._ids[low] = sorted(self._ids.get(low, []) + [after.id])
+
+    def get(self, question: str) -> list[int]:
+        return self._ids.get(question.lower(), [])
+
+
+class Snapshot:
+    """
+    Versione immutabile di una banca.
+    I lettori prendono bank.snapshot (una semplice lettura di attributo, niente lock)
+    e lavorano su quella per tutto l'handler, anche se nel frattempo qualcuno scrive.
+
+    - slots: Card nell'ordine di inserimento, comprese quelle eliminate (vedi Slots)
+    - by_id: id → posizione in slots (dict condiviso tra le versioni: si aggiungono
+      solo chiavi nuove, che le versioni più vecchie ignorano perché fuori dai loro slots)
+    - deleted: ID eliminati ("lapidi", vedi Tombstones), tolti davvero da slots solo con la compattazione
+    Le versioni successive condividono le Card non modificate.
+
+    Le strutture costruite al primo uso passano da una versione alla successiva
+    aggiornate solo per le card cambiate: l'indice di ricerca con una nuova ShardSet,
+    domande per testo, valutatore, quasi-duplicati, collegamenti e vettori sul posto (condivisi: chi
+    legge una versione vecchia può trovarci ID più nuovi, che get() scarta).
+    """
+
+    __slots__ = ("version", "slots", "by_id", "deleted", "next_id", "_shards", "_live", "_grader", "_dups",
+                 "_related", "_semantic", "_questions")
+
+    def __init__(self, version: int, slots: Slots, by_id: dict[int, int],
+                 deleted: Tombstones, next_id: int):
+        self.version = version
+        self.slots = slots
+        self.by_id = by_id
+        self.deleted = deleted
+        self.next_id = next_id
+        self._shards = None
+        self._live = None
+        self._grader = None
+        self._dups = None
+        self._related = None
+        self._semantic = None
+        self._questions = None
+
+    def __len__(self) -> int:
+        return len(self.slots) - len(self.deleted)
+
+    @property
+    def cards(self) -> tuple[Card, ...]:
+        """Le domande vive (senza quelle eliminate), nell'ordine di inserimento."""
+        if self._live is None:
+            dead = set(self.deleted)  # un set solo, invece di cercare blocco per blocco card per card
+            self._live = tuple(c for c in self.slots if c.id not in dead)
+        return self._live
+
+    def _structure(self, attr: str, build):
+        structure = getattr(self, attr)
+        if structure is None:
+            with _build_lock:
+                structure = getattr(self, attr)
+                if structure is None:
+                    structure = build(self.cards)
+                    setattr(self, attr, structure)
+        return structure
+
+    @property
+    def shards(self) -> ShardSet:
+        """
+        Indice di ricerca di questa versione: indici compilati, uno ogni SHARD_SIZE domande
+        (nell'ordine), più la coda delle modifiche recenti. Costruito al primo uso, poi
+        aggiornato card per card dalle versioni successive (vedi Bank._publish).
+        Le banche normali hanno un solo shard.
+        """
+        return self._structure("_shards", lambda cards: ShardSet.build(cards, SHARD_SIZE))
+
+    @property
+    def grader(self) -> Grader:
+        """Valutatore delle risposte del quiz per questa versione, costruito al primo uso."""
+        return self._structure("_grader", Grader)
+
+    @property
+    def near_duplicates(self) -> NearDuplicateIndex:
+        """Indice MinHash/LSH delle domande di questa versione, costruito al primo uso."""
+        return self._structure("_dups", NearDuplicateIndex.build)
+
+    @property
+    def related(self) -> RelatedGraph:
+        """Grafo delle domande collegate (dai Collegamenti) di questa versione, costruito al primo uso."""
+        return self._structure("_related", RelatedGraph.build)
+
+    @property
+    def semantic(self) -> SemanticIndex:
+        """Indice vettoriale (ricerca per significato) di questa versione, costruito al primo uso."""
+        return self._structure("_semantic", SemanticIndex.build)
+
+    @property
+    def questions(self) -> QuestionIndex:
+        """Testo → ID delle domande di questa versione, costruito al primo uso."""
+        return self._structure("_questions", QuestionIndex)
+
+    def missing(self, *names: str) -> list[str]:
+        """Quali delle strutture indicate (nomi di STRUCTURES) non sono ancora costruite."""
+        return [name for name in names if getattr(self, STRUCTURES[name]) is None]
+
+    def build(self, *names: str):
+        """
+        Costruisce le strutture indicate (tutte, se non se ne indica nessuna).
+        Con migliaia di domande ci vogliono secondi: dal bot si chiama in un thread.
+        """
+        for name in names or STRUCTURES:
+            getattr(self, name)
+
+    def similar(self, question: str, fingerprint: Fingerprint | None = None) -> Card | None:
+        """Una domanda quasi uguale (es. "Cos'è il TUEL?" per "cosa è il tuel"), se c'è."""
+        card_id = self.near_duplicates.find(question, fingerprint)
+        return self.get(card_id) if card_id is not None else None
+
+    def get(self, card_id: int) -> Card | None:
+        """La domanda con quell'ID, se esiste in questa versione."""
+        pos = self.by_id.get(card_id)
+        if pos is None or pos >= len(self.slots) or card_id in self.deleted:
+            return None
+        return self.slots[pos]
+
+    def random_card(self) -> Card | None:
+        """Una domanda a caso (le lapidi sono poche grazie alla compattazione)."""
+        if not len(self):
+            return None
+        while True:
+            card = random.choice(self.slots)
+            if card.id not in self.deleted:
+                return card
+
+    def find(self, question: str) -> Card | None:
+        """La domanda con quel testo (confronto senza maiuscole), se c'è."""
+        low = question.lower()
+        for card_id in self.questions.get(question):
+            # l'indice è condiviso con le versioni più nuove: controlliamo su questa
+            card = self.get(card_id)
+            if card is not None and card.question.lower() == low:
+                return card
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "next_id": self.next_id,
+            "questions": [card.to_dict() for card in self.cards],
+        }
+
+
+class Bank:
+    """
+    Una banca di domande: un file JSON + la versione attuale in memoria.
+    Chi scrive prende il lock, costruisce una nuova Snapshot e la pubblica
+    sostituendo bank.snapshot in un colpo solo.
+    Il lock è da thread e può restare preso a lungo (compattazione, importazioni):
+    dall'event loop i metodi che scrivono si chiamano con asyncio.to_thread.
+    """
+
+    def __init__(self, name: str, path: str):
+        self.name = name
+        self.path = path
+        data = load_knowledge_base(path)
+        self.arena = TextArena.for_texts(a for q in data.get("questions", []) for a in q.get("answers", []))
+        self.snapshot = _snapshot_from_dict(data, self.arena)
+        self._lock = threading.Lock()
+        self._shared: dict[int, str] = {}  # token dell'indice → file condiviso con i worker
+        self._shared_versions: list[tuple[int, set[int]]] = []  # (versione, token dei suoi indici)
+        self._shared_lock = threading.Lock()
+        self._fold_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dirty = False  # c'è una versione più nuova di quella sul file
+        self._saver: threading.Thread | None = None
+        # (versione, operazione) dopo l'ultimo backup consegnato; None finché nessuno ne chiede uno.
+        # Ci sono tutte quelle delle versioni dopo _ops_since
+        self._ops: list[tuple[int, dict]] | None = None
+        self._ops_since = 0
+        self._backup_version = None  # versione dell'ultimo backup consegnato da questo processo
+
+    @property
+    def size_estimate(self) -> int:
+        """
+        Byte di RAM stimati per questa banca, contando tutte le strutture: quelle non ancora
+        costruite lo saranno presto (il bot scalda ogni banca che carica).
+        """
+        snap = self.snapshot
+        n = len(snap.slots)
+        total = len(self.arena)
+        for name, per_card in CARD_BYTES.items():
+            structure = getattr(snap, STRUCTURES[name]) if name in STRUCTURES else None
+            nbytes = getattr(structure, "nbytes", None)
+            total += nbytes if nbytes is not None else n * per_card
+        return total
+
+    def shared_segments(self, snapshot: Snapshot) -> list[tuple[str, frozenset[int]]]:
+        """
+        Scrive (se non ci sono già) gli indici della versione indicata in file condivisi
+        per i worker del pool e restituisce (path, ID da saltare) per ognuno, come
+        ShardSet.segments. Un indice non cambia mai, quindi si scrive una volta sola:
+        dopo una modifica si scrive solo la coda.
+        """
+        segments = snapshot.shards.segments
+        with self._shared_lock:
+            out = []
+            for index, skip in segments:
+                path = self._shared.get(index.token)
+                if path is None:
+                    path = os.path.join(SHARED_INDEX_DIR, f"echobrain-{os.getpid()}-{self.name}-{index.token}.idx")
+                    tmp = path + ".tmp"
+                    with open(tmp, "wb") as file:
+                        file.write(index.buf)
+                    os.replace(tmp, path)
+                    self._shared[index.token] = path
+                out.append((path, skip))
+
+            # teniamo i file di qualche versione precedente: un task già in coda potrebbe doverli
+            # ancora aprire (chi li ha già in mmap continua a leggerli anche dopo la cancellazione)
+            if not self._shared_versions or snapshot.version > self._shared_versions[-1][0]:
+                self._shared_versions.append((snapshot.version, {index.token for index, _ in segments}))
+                del self._shared_versions[:-KEEP_SHARED_VERSIONS]
+                keep = set().union(*(tokens for _, tokens in self._shared_versions))
+                for token in [t for t in self._shared if t not in keep]:
+                    _remove(self._shared.pop(token))
+            return out
+
+    def _publish(self, slots: Slots, deleted: Tombstones, next_id: int,
+                 ops: list[dict]) -> Snapshot:
+        """
+        Pubblica una nuova versione e ne chiede il salvataggio su file (da chiamare col lock preso).
+        ops sono le operazioni che la producono, per il backup incrementale.
+        """
+        old = self.snapshot
+        snapshot = Snapshot(old.version + 1, slots, old.by_id, deleted, next_id)
+        _carry_over(old, snapshot, ops)
+        self.snapshot = snapshot
+        self._save_later()
+
+        if self._ops is not None:
+            self._ops.extend((snapshot.version, op) for op in ops)
+            if len(self._ops) > MAX_BACKUP_OPS:
+                self._ops = []
+                self._ops_since = snapshot.version
+                self._backup_version = None
+        return snapshot
+
+    def _save_later(self):
+        """
+        Salva la versione attuale in un thread, fuori dal lock: riscrivere il JSON vuol dire
+        decomprimere tutte le risposte (costa quanto la banca, non quanto la modifica).
+        Le modifiche che arrivano mentre si scrive finiscono tutte nel salvataggio successivo.
+        """
+        with self._save_lock:
+            self._dirty = True
+            if self._saver is None:
+                # non daemon: all'uscita il processo aspetta che il file sia scritto
+                self._saver = threading.Thread(target=self._save_loop, name=f"save-{self.name}")
+                self._saver.start()
+
+    def _save_loop(self):
+        while True:
+            with self._save_lock:
+                if not self._dirty:
+                    self._saver = None
+                    return
+                self._dirty = False
+            try:
+                save_knowledge_base(self.snapshot.to_dict(), self.path)
+            except OSError as e:
+                print(f"⚠️ Salvataggio della banca {self.name} non riuscito: {e}")
+
+    def flush(self):
+        """Aspetta che la versione attuale sia scritta su file."""
+        while True:
+            with self._save_lock:
+                saver = self._saver
+            if saver is None:
+                return
+            saver.join()
+
+    def add_answer(self, question: str, answer: str) -> Card:
+        """Aggiunge una risposta alla domanda (creandola se non esiste) e restituisce la card."""
+        with self._lock:
+            snap = self.snapshot
+            existing = snap.find(question)
+            if existing is None:
+                card = Card(snap.next_id, question, (answer,), self.arena)
+                snap.by_id[card.id] = len(snap.slots)
+                self._publish(snap.slots.appended((card,)), snap.deleted, snap.next_id + 1, [_add_op(card)])
+                return card
+
+            pos = snap.by_id[existing.id]
+            card = existing.with_answer(answer)
+            self._publish(snap.slots.replaced(pos, card), snap.deleted, snap.next_id, [_answer_op(card.id, answer)])
+            return card
+
+    def append_answer(self, card_id: int, answer: str) -> Card | None:
+        """Aggiunge una risposta alla domanda con quell'ID (None se non esiste più)."""
+        with self._lock:
+            snap = self.snapshot
+            existing = snap.get(card_id)
+            if existing is None:
+                return None
+            pos = snap.by_id[card_id]
+            card = existing.with_answer(answer)
+            self._publish(snap.slots.replaced(pos, card), snap.deleted, snap.next_id, [_answer_op(card_id, answer)])
+            return card
+
+    def add_cards(self, items: list[tuple[str, list[str]]],
+                  attach: dict[int, list[str]] | None = None) -> list[Card]:
+        """
+        Aggiunge tante domande nuove (e risposte a domande esistenti, in attach)
+        in una volta sola: una sola nuova versione e una sola scrittura del file,
+        qualunque sia il numero di domande.
+        """
+        with self._lock:
+            snap = self.snapshot
+            slots = snap.slots
+            ops = []
+            for card_id, answers in (attach or {}).items():
+                card = snap.get(card_id)
+                if card is not None:
+                    for answer in answers:
+                        card = card.with_answer(answer)
+                        ops.append(_answer_op(card_id, answer))
+                    slots = slots.replaced(snap.by_id[card_id], card)
+
+            next_id = snap.next_id
+            new_cards = []
+            for question, answers in items:
+                card = Card(next_id, question, answers, self.arena)
+                snap.by_id[next_id] = len(snap.slots) + len(new_cards)
+                new_cards.append(card)
+                ops.append({"op": "add", "id": next_id, "question": question, "answers": list(answers)})
+                next_id += 1
+            self._publish(slots.appended(new_cards), snap.deleted, next_id, ops)
+            return new_cards
+
+    def delete(self, card_id: int) -> Card | None:
+        """
+        Elimina la domanda con quell'ID e la restituisce.
+        In memoria è solo una lapide (O(1)): gli altri ID e le posizioni non cambiano.
+        """
+        with self._lock:
+            snap = self.snapshot
+            card = snap.get(card_id)
+            if card is None:
+                return None
+            self._publish(snap.slots, snap.deleted.added(card_id), snap.next_id, [{"op": "delete", "id": card_id}])
+            return card
+
+    def apply_ops(self, ops: list[dict]) -> int:
+        """
+        Riapplica le operazioni di un backup incrementale (in una sola nuova versione).
+        Si può riapplicare lo stesso delta senza creare doppioni: le domande che esistono
+        già (stesso ID) e le risposte già presenti vengono saltate.
+        Restituisce quante operazioni hanno cambiato qualcosa.
+        """
+        with self._lock:
+            snap = self.snapshot
+            slots = snap.slots
+            deleted = snap.deleted
+            next_id = snap.next_id
+            applied = []
+            for op in ops:
+                card_id = op.get("id")
+                pos = snap.by_id.get(card_id)
+                if pos is not None and pos >= len(slots):
+                    pos = None
+                kind = op.get("op")
+                if kind == "add" and pos is None and isinstance(card_id, int):
+                    snap.by_id[card_id] = len(slots)
+                    slots = slots.appended((Card(card_id, op["question"], op["answers"], self.arena),))
+                    next_id = max(next_id, card_id + 1)
+                elif (kind == "answer" and pos is not None and card_id not in deleted
+                      and op["answer"] not in slots[pos].answers):
+                    slots = slots.replaced(pos, slots[pos].with_answer(op["answer"]))
+                elif kind == "delete" and pos is not None and card_id not in deleted:
+                    deleted = deleted.added(card_id)
+                else:
+                    continue
+                applied.append(op)
+            if applied:
+                self._publish(slots, deleted, next_id, applied)
+            return len(applied)
+
+    def backup(self, delta: bool = False) -> tuple[bytes, str, int]:
+        """
+        Backup compresso (gzip) della versione attuale: (contenuto, nome del file, versione).
+        Completo, è lo stesso JSON di db.json. Con delta=True contiene solo le
+        operazioni dall'ultimo backup consegnato; se questo processo non ne ha ancora
+        consegnato uno (o le operazioni sono troppe) diventa completo.
+        Il backup diventa la base dei delta successivi solo con backup_sent, quando è
+        arrivato davvero: se l'invio fallisce, il prossimo delta contiene ancora tutto.
+        Il lock serve solo a prendere versione e operazioni insieme:
+        serializzare e comprimere (lavoro lento, da thread) non blocca chi scrive.
+        """
+        with self._lock:
+            snap = self.snapshot
+            base = self._backup_version
+            if self._ops is None:
+                self._ops = []  # da qui in poi le operazioni servono al prossimo delta
+                self._ops_since = snap.version
+            ops = [op for _, op in self._ops]
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        if delta and base is not None:
+            data = {"bank": self.name, "base_version": base, "version": snap.version, "ops": ops}
+            filename = f"{self.name}-{stamp}.delta.json.gz"
+        else:
+            data = snap.to_dict()
+            filename = f"{self.name}-{stamp}.json.gz"
+        raw = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return gzip.compress(raw, compresslevel=6), filename, snap.version
+
+    def backup_sent(self, version: int):
+        """Il backup della versione indicata è stato consegnato: i prossimi delta partono da lì."""
+        with self._lock:
+            if self._backup_version is not None and version <= self._backup_version:
+                return  # ne è già stato consegnato uno più recente
+            if version < self._ops_since:
+                return  # operazioni scartate nel frattempo (troppe): il prossimo sarà completo
+            self._ops = [(v, op) for v, op in self._ops if v > version]
+            self._backup_version = version
+
+    def warm(self):
+        """
+        Costruisce tutte le strutture della versione attuale (pensata per girare in background
+        dopo il caricamento). Se nel frattempo esce una versione nuova, le strutture già pronte
+        ci passano con _publish; si completa quella.
+        """
+        while True:
+            snapshot = self.snapshot
+            snapshot.build()
+            if self.snapshot is snapshot:
+                return
+
+    def needs_compaction(self) -> bool:
+        deleted = len(self.snapshot.deleted)
+        return deleted >= COMPACT_MIN_DELETED and deleted * 10 >= len(self.snapshot.slots)
+
+    def compact(self):
+        """
+        Toglie davvero le domande eliminate (pensata per girare in background),
+        anche dall'arena dei testi compressi.
+        Il contenuto non cambia, quindi la versione e l'indice compilato restano gli stessi.
+        """
+        with self._lock:
+            old = self.snapshot
+            if not old.deleted:
+                return
+            arena = self.arena.empty_copy()
+            slots = Slots(card.moved_to(arena) for card in old.cards)
+            by_id = {card.id: pos for pos, card in enumerate(slots)}
+            snapshot = Snapshot(old.version, slots, by_id, Tombstones(), old.next_id)
+            snapshot._shards = old._shards
+            snapshot._grader = old._grader
+            snapshot._dups = old._dups
+            snapshot._related = old._related
+            snapshot._semantic = old._semantic
+            snapshot._questions = old._questions
+            self.arena = arena
+            self.snapshot = snapshot
+
+    def fold_index(self):
+        """
+        Rifonde negli shard la coda delle modifiche dell'indice di ricerca (pensata per girare
+        in background, come compact). Il lavoro lento si fa senza lock su un ShardSet che non
+        cambia; poi, col lock, ci si riapplicano sopra le modifiche arrivate nel frattempo.
+        """
+        if not self._fold_lock.acquire(blocking=False):
+            return  # ci sta già pensando un altro thread
+        try:
+            base = self.snapshot._shards
+            if base is None or not base.needs_fold():
+                return
+            folded = base.folded(SHARD_SIZE)
+            with self._lock:
+                current = self.snapshot._shards
+                # stessa discendenza (ogni versione riusa gli shard della precedente)?
+                if current is not None and current.shards is base.shards:
+                    self.snapshot._shards = folded.rebased(base, current)
+        finally:
+            self._fold_lock.release()
+
+    def needs_fold(self) -> bool:
+        shards = self.snapshot._shards
+        return shards is not None and shards.needs_fold()
+
+    def close(self):
+        """Cancella i file degli indici condivisi."""
+        with self._shared_lock:
+            for path in self._shared.values():
+                _remove(path)
+            self._shared = {}
+            self._shared_versions = []
+
+
+def _carry_over(old: Snapshot, new: Snapshot, ops: list[dict]):
+    """
+    Porta nella nuova versione le strutture già costruite sulla vecchia, aggiornate
+    solo per le card toccate da ops: costa quanto quelle card, non quanto la banca.
+    """
+    changes = [(card_id, old.get(card_id), new.get(card_id)) for card_id in dict.fromkeys(op["id"] for op in ops)]
+    if old._shards is not None:
+        new._shards = old._shards.updated(changes)
+    for attr in ("_grader", "_dups", "_related", "_semantic", "_questions"):
+        structure = getattr(old, attr)
+        if structure is not None:
+            for _, before, after in changes:
+                if before is not None or after is not None:
+                    structure.update(before, after)
+            setattr(new, attr, structure)
+
+
+def _add_op(card: Card) -> dict:
+    return {"op": "add", "id": card.id, "question": card.question, "answers": list(card.answers)}
+
+
+def _answer_op(card_id: int, answer: str) -> dict:
+    return {"op": "answer", "id": card_id, "answer": answer}
+
+
+def _snapshot_from_dict(data: dict, arena: TextArena | None = None) -> Snapshot:
+    """
+    Costruisce la prima versione di una banca dal JSON.
+    Le domande senza ID (es. db.json storico) ricevono ID progressivi
+    nell'ordine del file, quindi uguali ai vecchi numeri di /questions.
+    """
+    questions = data.get("questions", [])
+    used = {q["id"] for q in questions if isinstance(q.get("id"), int)}
+    next_id = max(data.get("next_id", 1), max(used, default=0) + 1)
+
+    slots = []
+    seen = set()
+    for q in questions:
+        card_id = q.get("id")
+        if not isinstance(card_id, int) or card_id in seen:
+            card_id = next_id
+            next_id += 1
+        seen.add(card_id)
+        slots.append(Card(card_id, q.get("question", "Domanda senza testo"), q.get("answers", []), arena))
+
+    by_id = {card.id: pos for pos, card in enumerate(slots)}
+    return Snapshot(0, Slots(slots), by_id, Tombstones(), next_id)
+
+
+class BankManager:
+    """
+    Gestisce più banche di domande (una per file).
+    - le banche si caricano solo quando qualcuno le usa
+    - se si supera il budget di memoria, si scaricano quelle usate meno di recente
+    Le modifiche vengono salvate su file subito (in background), quindi scaricare una banca è sicuro.
+    Una banca scaricata mentre qualcuno la sta ancora usando (es. un /import a metà) resta
+    però quella buona per il suo file: se serve di nuovo si riprende lei, invece di caricarne
+    una seconda copia che sovrascriverebbe le modifiche della prima.
+    """
+
+    def __init__(self, default_path: str, banks_dir: str, memory_budget: int):
+        self.default_path = default_path
+        self.banks_dir = banks_dir
+        self.memory_budget = memory_budget
+        self._loaded: OrderedDict[str, Bank] = OrderedDict()
+        self._evicted: weakref.WeakValueDictionary[str, Bank] = weakref.WeakValueDictionary()
+        self._loading: dict[str, threading.Lock] = {}  # nome → lock di chi la sta caricando
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def path_for(self, name: str) -> str:
+        if name == DEFAULT_BANK:
+            return self.default_path
+        return os.path.join(self.banks_dir, f"{name}.json")
+
+    def names(self) -> list[str]:
+        """Elenco delle banche disponibili (la default è sempre la prima)."""
+        names = [DEFAULT_BANK]
+        if os.path.isdir(self.banks_dir):
+            for filename in sorted(os.listdir(self.banks_dir)):
+                stem, ext = os.path.splitext(filename)
+                if ext == ".json" and BANK_NAME_RE.match(stem) and stem != DEFAULT_BANK:
+                    names.append(stem)
+        return names
+
+    def exists(self, name: str) -> bool:
+        return name == DEFAULT_BANK or os.path.exists(self.path_for(name))
+
+    def cached(self, name: str) -> Bank | None:
+        """La banca se è già in memoria (aggiornando l'ordine LRU), senza mai caricarla: non blocca."""
+        with self._lock:
+            bank = self._loaded.get(name)
+            if bank is not None:
+                self._loaded.move_to_end(name)
+                return bank
+
+            # scaricata ma ancora in uso da qualcuno: si riprende la stessa
+            bank = self._evicted.pop(name, None)
+            if bank is not None:
+                self._loaded[name] = bank
+                self._evict(keep=name)
+            return bank
+
+    def get(self, name: str) -> Bank:
+        """
+        Restituisce la banca, caricandola se serve e aggiornando l'ordine LRU.
+        Caricare una banca grande richiede secondi: dal bot si chiama in un thread.
+        Il caricamento avviene fuori dal lock, così le banche già in memoria restano
+        disponibili; due richieste della stessa banca ne caricano una sola.
+        """
+        bank = self.cached(name)
+        if bank is not None:
+            return bank
+
+        with self._lock:
+            loading = self._loading.setdefault(name, threading.Lock())
+        with loading:
+            bank = self.cached(name)  # caricata da chi ci ha preceduto?
+            if bank is None:
+                bank = Bank(name, self.path_for(name))
+                with self._lock:
+                    self._loaded[name] = bank
+                    self._evict(keep=name)
+            with self._lock:
+                self._loading.pop(name, None)
+        return bank
+
+    def _evict(self, keep: str):
+        """Scarica le banche meno usate finché non rientriamo nel budget."""
+        total = sum(b.size_estimate for b in self._loaded.values())
+        for name in list(self._loaded):
+            if total <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            bank = self._loaded.pop(name)
+            bank.close()
+            self._evicted[name] = bank
+            total -= bank.size_estimate
+
+    def close(self):
+        for bank in self._loaded.values():
+            bank.flush()
+            bank.close()
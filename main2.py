@@ -1,10 +1,15 @@
-import json
+import asyncio
 import os
-import random
-from difflib import get_close_matches
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial, wraps
 
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackContext, filters
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, CallbackContext, filters
+
+from admission import Admission
+from kb_import import detect_format, import_bytes
+from kb_search import filter_questions, match_shards, normalize, run_shared
+from kb_store import DEFAULT_BANK, BANK_NAME_RE, Bank, BankManager, Snapshot
 
 # Token del bot (da variabile d'ambiente)
 TOKEN = os.getenv("TOKEN")
@@ -12,79 +17,153 @@ TOKEN = os.getenv("TOKEN")
 # per il backup
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "1234")  # meglio da env, ma ha default
 
-# Percorso del database JSON
+# Percorso del database JSON (banca di default)
 DB_FILE = "db.json"
 
+# Cartella con le altre banche di domande (una per file: banks/<nome>.json)
+BANKS_DIR = os.getenv("BANKS_DIR", "banks")
 
-def load_knowledge_base() -> dict:
-    """Carica la knowledge base da un file JSON."""
-    if not os.path.exists(DB_FILE):
-        return {"questions": []}
+# Quanta RAM possono occupare al massimo le banche caricate insieme
+BANKS_MEMORY_MB = int(os.getenv("BANKS_MEMORY_MB", "256"))
 
-    try:
-        with open(DB_FILE, "r", encoding="utf-8") as file:
-            return json.load(file)
-    except (json.JSONDecodeError, FileNotFoundError):
-        return {"questions": []}
+# Quante risposte recenti del quiz ricordare per /stats
+STATS_HISTORY = 10
+
+# Processi dedicati alla ricerca (0 = tutto nel processo del bot)
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "0"))
+
+# Controllo di ammissione: ogni utente ha USER_BURST gettoni che si ricaricano a USER_RATE al secondo,
+# il bot nel suo insieme GLOBAL_BURST a GLOBAL_RATE al secondo; con più di MAX_QUEUE aggiornamenti
+# in coda si scarta tutto finché la coda non si smaltisce
+USER_RATE = float(os.getenv("USER_RATE", "1"))
+USER_BURST = float(os.getenv("USER_BURST", "10"))
+GLOBAL_RATE = float(os.getenv("GLOBAL_RATE", "30"))
+GLOBAL_BURST = float(os.getenv("GLOBAL_BURST", "60"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "200"))
+
+# Quanti gettoni costa ogni richiesta: ben sotto USER_BURST, o passerebbe solo col secchio pieno
+COST_MESSAGE = 1
+COST_QUESTIONS = 3
+COST_BACKUP = 5
+
+# Quante domande proporre con "Forse intendevi…" quando non c'è una risposta sicura
+SUGGESTIONS = 3
+
+# Lunghezza massima di un messaggio Telegram (4096), con un po' di margine
+MAX_MESSAGE = 4000
 
-def save_knowledge_base(data: dict):
-    """Salva la knowledge base nel file JSON locale."""
-    with open(DB_FILE, "w", encoding="utf-8") as file:
-        json.dump(data, file, indent=2, ensure_ascii=False)
 
-def find_best_match(user_question: str, knowledge_base: dict) -> str | None:
+async def load_bank(context: CallbackContext, name: str) -> Bank:
+    """
+    La banca con quel nome: se non è in memoria si carica in un thread (per le banche grandi
+    ci vogliono secondi), e subito dopo se ne costruiscono gli indici in background.
+    """
+    bank = banks.cached(name)
+    if bank is None:
+        bank = await asyncio.to_thread(banks.get, name)
+        context.application.create_task(asyncio.to_thread(bank.warm))
+    return bank
+
+async def current_bank(context: CallbackContext) -> Bank:
+    """Banca di domande scelta dall'utente con /bank (di default quella di db.json)."""
+    return await load_bank(context, context.user_data.get("bank", DEFAULT_BANK))
+
+async def ready(snap: Snapshot, *names: str) -> None:
+    """
+    Si assicura che le strutture indicate di snap (es. "related", vedi kb_store.STRUCTURES)
+    siano costruite: se non lo sono (la banca è appena stata caricata) si costruiscono in un thread,
+    o si aspetta quello che le sta già costruendo, senza fermare l'event loop.
+    """
+    if snap.missing(*names):
+        await asyncio.to_thread(snap.build, *names)
+
+def find_best_match(user_question: str, bank: Bank) -> str | None:
     """
     Trova la domanda migliore:
     1) per parola chiave nella domanda,
     2) poi nelle risposte,
     3) poi fuzzy match,
-    usando uno score.
+    usando uno score (vedi kb_search.match_shards),
+    4) e se non basta per significato (vedi semantic.SemanticIndex).
     """
+    snap = bank.snapshot
+    card_id, _ = match_shards(scatter_for(bank, snap), user_question)
+    if card_id is None:
+        card_id = snap.semantic.best(user_question)
+    card = snap.get(card_id) if card_id is not None else None
+    return card.question if card else None
 
-    user = user_question.lower().strip()
-
-    best_q = None
-    best_score = 0
-
-    # 1) Scoring manuale su tutte le domande
-    for q in knowledge_base["questions"]:
-        q_text = q["question"].lower()
-        answers = [a.lower() for a in q.get("answers", [])]
-
-        score = 0
 
-        # parola chiave nel testo della domanda
-        if user in q_text:
-            score += 5
+def scatter_for(bank: Bank, snap: Snapshot):
+    """
+    Funzione scatter(fn, *args) che esegue fn(shard, *args, ID da saltare) su ogni pezzo
+    dell'indice della versione snap (vedi kb_search.ShardSet) e restituisce i risultati:
+    in parallelo nel pool di processi se attivo (SEARCH_WORKERS > 0), altrimenti qui.
+    """
+    if search_pool is None:
+        return lambda fn, *args: [fn(index, *args, skip) for index, skip in snap.shards.segments]
 
-        # parola chiave nelle risposte
-        if any(user in a for a in answers):
-            score += 3
+    segments = bank.shared_segments(snap)
 
-        # preferisci domande corte per definizioni (es. "Cos'è il TUEL?")
-        score -= len(q_text) / 200.0  # penalità piccola per le domande molto lunghe
+    def scatter(fn, *args):
+        futures = [search_pool.submit(partial(run_shared, fn, path, *args, skip)) for path, skip in segments]
+        return [future.result() for future in futures]
 
-        # se questa domanda ha punteggio migliore, tienila
-        if score > best_score:
-            best_score = score
-            best_q = q["question"]
+    return scatter
 
-    # Se abbiamo trovato qualcosa con score > 0, usiamo quello
-    if best_q and best_score > 0:
-        return best_q
 
-    # 2) Se proprio nulla, usiamo fuzzy match sul testo delle domande
-    questions_texts = [q["question"] for q in knowledge_base["questions"]]
-    matches = get_close_matches(user_question, questions_texts, n=1, cutoff=0.4)
-    return matches[0] if matches else None
+def schedule_maintenance(context: CallbackContext, bank: Bank):
+    """Dopo una modifica: compattazione e rifusione dell'indice, in background, se servono."""
+    # troppe lapidi → le togliamo
+    if bank.needs_compaction():
+        context.application.create_task(asyncio.to_thread(bank.compact))
+    # troppe modifiche in coda all'indice di ricerca → le rifondiamo negli shard
+    if bank.needs_fold():
+        context.application.create_task(asyncio.to_thread(bank.fold_index))
 
 
-def get_answer_for_question(question: str, knowledge_base: dict) -> list:
+def rate_limited(kind: str, cost: float):
+    """
+    Mette l'handler dietro il controllo di ammissione: se l'utente (o il bot intero) ha finito
+    i gettoni la richiesta si scarta con un avviso (uno ogni tanto, gli altri in silenzio)
+    invece di finire in fila dietro a ricerche e salvataggi.
+    """
+    def decorate(handler):
+        @wraps(handler)
+        async def run(update: Update, context: CallbackContext) -> None:
+            user_id = update.effective_user.id if update.effective_user else 0
+            depth = context.application.update_queue.qsize()
+            if not admission.admit(user_id, kind, cost, depth):
+                if update.message and admission.should_warn(user_id):
+                    await update.message.reply_text("⏳ Troppe richieste, riprova tra qualche secondo.")
+                return
+            with admission.track(kind):
+                await handler(update, context)
+        return run
+    return decorate
+
+async def run_search(fn, bank: Bank, snap: Snapshot, *args) -> list:
+    """Esegue fn(shard, *args) su ogni shard della versione snap (vedi scatter_for)."""
+    await ready(snap, "shards")
+    if search_pool is None:
+        return scatter_for(bank, snap)(fn, *args)
+    # in un thread: scrivere gli indici condivisi (al primo uso dopo un caricamento o una
+    # rifusione) e aspettare i worker non deve bloccare l'event loop
+    return await asyncio.to_thread(lambda: scatter_for(bank, snap)(fn, *args))
+
+
+async def run_match(bank: Bank, snap: Snapshot, user_question: str, k: int = 0):
+    """kb_search.match_shards sugli shard della versione snap (vedi scatter_for)."""
+    await ready(snap, "shards")
+    if search_pool is None:
+        return match_shards(scatter_for(bank, snap), user_question, k)
+    return await asyncio.to_thread(lambda: match_shards(scatter_for(bank, snap), user_question, k))
+
+
+def get_answer_for_question(question: str, bank: Bank) -> tuple[str, ...]:
     """Restituisce tutte le risposte disponibili per una domanda."""
-    for q in knowledge_base["questions"]:
-        if q["question"].lower() == question.lower():
-            return q.get("answers", [])
-    return []
+    card = bank.snapshot.find(question)
+    return card.answers if card else ()
 
 def format_answer_from_list(answers: list[str]) -> str:
     """
@@ -123,6 +202,121 @@ def format_answer_from_list(answers: list[str]) -> str:
 
     return "\n\n".join(parts)
 
+async def related_keyboard(bank: Bank, snap: Snapshot, card_id: int) -> InlineKeyboardMarkup | None:
+    """Bottone "Domande collegate" da mettere sotto una risposta (solo se la card ne ha)."""
+    await ready(snap, "related")
+    if not snap.related.get(card_id):
+        return None
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton("🔗 Domande collegate", callback_data=f"rel:{bank.name}:{card_id}")]]
+    )
+
+async def send_card(message, bank: Bank, snap: Snapshot, card) -> None:
+    """Mostra domanda e risposta di una card, con il bottone delle domande collegate."""
+    formatted = format_answer_from_list(card.answers)
+    await message.reply_text(
+        f"❓ *Domanda n.{card.id}:* {card.question}\n\n{formatted}",
+        parse_mode="Markdown",
+        reply_markup=await related_keyboard(bank, snap, card.id)
+    )
+
+async def send_related(message, bank: Bank, snap: Snapshot, card_id: int) -> None:
+    """Elenca le domande collegate a una card, ognuna con il suo bottone per aprirla."""
+    card = snap.get(card_id)
+    if card is None:
+        await message.reply_text("❌ Domanda non trovata. Controlla la lista con /questions.")
+        return
+
+    await ready(snap, "related")
+    linked = [c for c in (snap.get(i) for i in snap.related.get(card_id)) if c is not None]
+    if not linked:
+        await message.reply_text("🔗 Nessuna domanda collegata a questa.")
+        return
+
+    buttons = [
+        [InlineKeyboardButton(f"{c.id}. {c.question}"[:60], callback_data=f"show:{bank.name}:{c.id}")]
+        for c in linked
+    ]
+    # niente Markdown: il testo della domanda può contenere * o _
+    await message.reply_text(
+        f"🔗 Domande collegate a n.{card.id}: {card.question}",
+        reply_markup=InlineKeyboardMarkup(buttons)
+    )
+
+class Turn:
+    """
+    Il prossimo turno di quiz/flash già pronto: la soluzione della card attuale
+    e la domanda successiva, scelte e formattate mentre l'utente pensa.
+    """
+
+    __slots__ = ("card", "solution", "next_card", "next_prompt")
+
+    def __init__(self, card, solution: str, next_card, next_prompt: str):
+        self.card = card
+        self.solution = solution
+        self.next_card = next_card
+        self.next_prompt = next_prompt
+
+
+def prepare_turn(snap: Snapshot, card, mode: str) -> Turn:
+    """Formatta la soluzione di card e sceglie/formatta la domanda successiva (mode = "quiz" o "flash")."""
+    solution = format_answer_from_list(card.answers)
+    next_card = snap.random_card()
+
+    if mode == "flash":
+        return Turn(
+            card,
+            f"✅ *Risposta flash:*\n*{card.question}*\n\n{solution}",
+            next_card,
+            f"⚡ Prossima flashcard:\n❓ *{next_card.question}*\n\n"
+            "✏️ Scrivi qualsiasi cosa per vedere la risposta.\n"
+            "🛑 /stopflash per uscire."
+        )
+
+    # il quiz valuterà la risposta: prepariamo anche le parole chiave della card
+    snap.grader.key(card)
+    return Turn(
+        card,
+        f"✅ *Soluzione ufficiale per la domanda n.{card.id}:*\n*{card.question}*\n\n{solution}",
+        next_card,
+        f"🧠 Prossima domanda n.{next_card.id}:\n*{next_card.question}*\n\n"
+        "✏️ Scrivi la tua risposta oppure *skip* per passare.\n"
+        "🛑 /stopquiz per uscire."
+    )
+
+def prefetch_turn(context: CallbackContext, snap: Snapshot, card, mode: str) -> None:
+    """Prepara in background il turno di card (il task resta in user_data["<mode>_next"])."""
+    context.user_data[f"{mode}_next"] = context.application.create_task(
+        asyncio.to_thread(prepare_turn, snap, card, mode)
+    )
+
+async def prefetched_turn(context: CallbackContext, snap: Snapshot, card, mode: str) -> Turn | None:
+    """
+    Il turno preparato in background per card, se è ancora valido (stessa card e domanda
+    successiva ancora presente in questa versione della banca).
+    """
+    pending = context.user_data.pop(f"{mode}_next", None)
+    if pending is not None:
+        turn = await pending
+        if turn.card is card and snap.get(turn.next_card.id) is turn.next_card:
+            return turn
+    return None
+
+async def take_turn(context: CallbackContext, snap: Snapshot, card, mode: str) -> Turn:
+    """Il turno preparato per card (vedi prefetched_turn), altrimenti lo prepara adesso."""
+    return await prefetched_turn(context, snap, card, mode) or prepare_turn(snap, card, mode)
+
+async def reply_parts(message, parts: list[str]) -> None:
+    """Invia i testi uniti nel minor numero di messaggi possibile (ognuno sotto MAX_MESSAGE)."""
+    block = ""
+    for part in parts:
+        if block and len(block) + len(part) + 2 > MAX_MESSAGE:
+            await message.reply_text(block, parse_mode="Markdown")
+            block = ""
+        block = f"{block}\n\n{part}" if block else part
+    if block:
+        await message.reply_text(block, parse_mode="Markdown")
+
 async def start(update: Update, context: CallbackContext) -> None:
     await update.message.reply_text(
         "👋 Ciao! Scrivi una domanda! Digita /help per vedere i comandi."
@@ -135,21 +329,32 @@ async def help_command(update: Update, context: CallbackContext) -> None:
         "/help - Mostra questo messaggio 📖\n"
         "/questions - Elenca solo le domande disponibili ❓\n"
         "/questions <parola> - Filtra le domande che contengono quella parola 🔍\n"
+        "/related [numero] - Domande collegate (all'ultima risposta, o a quella col numero) 🔗\n"
         "/quiz - Avvia un quiz con domande casuali 🧠\n"
         "/stopquiz - Termina la modalità quiz 🛑\n"
+        "/stats - Le tue statistiche del quiz 📊\n"
         "/flash - Avvia la modalità flashcard veloce ⚡\n"
         "/stopflash - Termina la modalità flashcard 🛑\n"
-        "/backup <password> - Fai il backup del json 🔐\n"
+        "/backup <password> [delta] - Fai il backup del json (delta: solo le modifiche dall'ultimo) 🔐\n"
         "/delete <numero> - Elimina una domanda dal database 🗑️\n"
+        "/duplicates <password> - Elenca le domande quasi duplicate 🔁\n"
+        "/load <password> - Carico del bot: coda, richieste scartate, latenze 📈\n"
+        "/bank - Elenca le banche di domande 🗂️\n"
+        "/bank <nome> - Passa a un'altra banca di domande 🔀\n"
+        "📥 Invia un file .csv/.jsonl/.md con didascalia /import <password> per importare domande\n"
         "👉 Scrivi una domanda ..."
     )
     await update.message.reply_text(help_text, parse_mode="Markdown")
 
+@rate_limited("backup", COST_BACKUP)
 async def backup(update: Update, context: CallbackContext) -> None:
-    """Invia il file db.json reale usato dal bot, protetto da password."""
-    # Controllo password: /backup <password>
+    """
+    Invia un backup compresso della banca attiva, protetto da password.
+    /backup <password> → tutta la banca, /backup <password> delta → solo le modifiche dall'ultimo backup.
+    """
+    # Controllo password: /backup <password> [delta]
     if not context.args:
-        await update.message.reply_text("🔐 Usa: /backup <password>")
+        await update.message.reply_text("🔐 Usa: /backup <password> [delta]")
         return
 
     supplied_password = context.args[0]
@@ -158,35 +363,49 @@ async def backup(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("⛔ Password errata.")
         return
 
-    # Ok, password corretta → invio il file
-    if not os.path.exists(DB_FILE):
-        await update.message.reply_text("⚠️ Nessun database trovato.")
-        return
-    
+    # Ok, password corretta → backup della versione attuale della banca attiva
+    # (dalla memoria, non dal file che qualcuno potrebbe star riscrivendo),
+    # serializzato e compresso fuori dall'event loop
+    bank = await current_bank(context)
+    delta = len(context.args) > 1 and context.args[1].lower() == "delta"
+    data, filename, version = await asyncio.to_thread(bank.backup, delta)
+
+    if filename.endswith(".delta.json.gz"):
+        caption = f"📦 Backup incrementale della banca *{bank.name}*"
+    elif delta:
+        caption = f"📦 Backup completo della banca *{bank.name}* (è il primo da quando il bot è partito)"
+    else:
+        caption = f"📦 Backup della banca *{bank.name}*"
+
     await update.message.reply_document(
-        document=open(DB_FILE, "rb"),
-        filename="db.json",
-        caption="📦 Backup del database attuale"
+        document=data,
+        filename=filename,
+        caption=caption,
+        parse_mode="Markdown"
     )
+    # solo adesso che è arrivato diventa la base del prossimo delta
+    await asyncio.to_thread(bank.backup_sent, version)
 
 async def quiz_command(update: Update, context: CallbackContext) -> None:
     """Avvia un quiz: il bot fa domande dal JSON e tu rispondi."""
-    if not knowledge_base["questions"]:
+    snap = (await current_bank(context)).snapshot
+
+    # scegliamo una domanda a caso
+    question_obj = snap.random_card()
+    if question_obj is None:
         await update.message.reply_text("🤖 Il database è vuoto, non posso fare il quiz.")
         return
 
-    # scegliamo una domanda a caso
-    index = random.randrange(len(knowledge_base["questions"]))
-    question_obj = knowledge_base["questions"][index]
-    question_text = question_obj.get("question", "Domanda senza testo")
+    question_text = question_obj.question
 
-    # salviamo lo stato del quiz per l'utente
+    # salviamo lo stato del quiz per l'utente (per ID, non per posizione)
     context.user_data["quiz_mode"] = True
-    context.user_data["quiz_index"] = index
+    context.user_data["quiz_id"] = question_obj.id
+    prefetch_turn(context, snap, question_obj, "quiz")
 
     await update.message.reply_text(
         "🧠 *Quiz iniziato!*\n\n"
-        f"Domanda n.{index + 1}:\n*{question_text}*\n\n"
+        f"Domanda n.{question_obj.id}:\n*{question_text}*\n\n"
         "✏️ Scrivi la tua risposta.\n"
         "⏭️ Scrivi *skip* per cambiare domanda.\n"
         "🛑 Digita /stopquiz per uscire dal quiz.",
@@ -197,27 +416,57 @@ async def stopquiz_command(update: Update, context: CallbackContext) -> None:
     """Termina la modalità quiz per l'utente."""
     if context.user_data.get("quiz_mode"):
         context.user_data.pop("quiz_mode", None)
-        context.user_data.pop("quiz_index", None)
+        context.user_data.pop("quiz_id", None)
+        context.user_data.pop("quiz_next", None)
         await update.message.reply_text("🛑 Modalità quiz terminata. Torniamo alle domande normali.")
     else:
         await update.message.reply_text("🤖 Non sei in modalità quiz al momento.")
 
+def record_quiz_score(context: CallbackContext, card_id: int, score: int) -> None:
+    """Aggiorna le statistiche del quiz dell'utente (usate da /stats)."""
+    stats = context.user_data.setdefault("quiz_stats", {"answers": 0, "total": 0, "best": 0, "last": []})
+    stats["answers"] += 1
+    stats["total"] += score
+    stats["best"] = max(stats["best"], score)
+    stats["last"] = (stats["last"] + [(card_id, score)])[-STATS_HISTORY:]
+
+async def stats_command(update: Update, context: CallbackContext) -> None:
+    """Mostra le statistiche del quiz dell'utente."""
+    stats = context.user_data.get("quiz_stats")
+    if not stats or not stats["answers"]:
+        await update.message.reply_text("📊 Nessuna risposta al quiz ancora. Inizia con /quiz!")
+        return
+
+    average = stats["total"] / stats["answers"]
+    last = "\n".join(f"• domanda n.{card_id}: {score}%" for card_id, score in reversed(stats["last"]))
+
+    await update.message.reply_text(
+        "📊 *Le tue statistiche del quiz:*\n\n"
+        f"Risposte date: {stats['answers']}\n"
+        f"Media: {average:.0f}%\n"
+        f"Migliore: {stats['best']}%\n\n"
+        f"*Ultime risposte:*\n{last}",
+        parse_mode="Markdown"
+    )
+
 async def flash_command(update: Update, context: CallbackContext) -> None:
     """
     Avvia la modalità flashcard:
     - il bot mostra una domanda
     - ad ogni tuo messaggio ti mostra la risposta e passa alla successiva
     """
-    if not knowledge_base["questions"]:
+    snap = (await current_bank(context)).snapshot
+
+    question_obj = snap.random_card()
+    if question_obj is None:
         await update.message.reply_text("🤖 Il database è vuoto, non posso fare flashcard.")
         return
 
-    index = random.randrange(len(knowledge_base["questions"]))
-    question_obj = knowledge_base["questions"][index]
-    question_text = question_obj.get("question", "Domanda senza testo")
+    question_text = question_obj.question
 
     context.user_data["flash_mode"] = True
-    context.user_data["flash_index"] = index
+    context.user_data["flash_id"] = question_obj.id
+    prefetch_turn(context, snap, question_obj, "flash")
 
     await update.message.reply_text(
         "⚡ *Modalità flashcard attivata!*\n\n"
@@ -231,11 +480,13 @@ async def stopflash_command(update: Update, context: CallbackContext) -> None:
     """Termina la modalità flashcard."""
     if context.user_data.get("flash_mode"):
         context.user_data.pop("flash_mode", None)
-        context.user_data.pop("flash_index", None)
+        context.user_data.pop("flash_id", None)
+        context.user_data.pop("flash_next", None)
         await update.message.reply_text("🛑 Modalità flashcard terminata. Torniamo alle domande normali.")
     else:
         await update.message.reply_text("🤖 Non sei in modalità flashcard al momento.")
 
+@rate_limited("questions", COST_QUESTIONS)
 async def questions_command(update: Update, context: CallbackContext) -> None:
     """
     Elenca le domande disponibili.
@@ -243,36 +494,23 @@ async def questions_command(update: Update, context: CallbackContext) -> None:
     - /questions tuel             → domande filtrate per 'tuel'
     - /questions enti locali      → filtro su più parole
     """
-
-    def normalize(s: str) -> str:
-        # minuscolo + togliamo punteggiatura "strana"
-        out = []
-        for ch in s.lower():
-            if ch.isalnum() or ch.isspace():
-                out.append(ch)
-            else:
-                # trasformiamo simboli in spazio (es. ?, -, , ecc.)
-                out.append(" ")
-        # togliamo spazi doppi
-        return " ".join("".join(out).split())
+    bank = await current_bank(context)
+    snap = bank.snapshot
+    cards = snap.cards
 
     # termini cercati (normalizzati)
     query_terms = [normalize(t) for t in context.args] if context.args else []
 
-    if not knowledge_base["questions"]:
+    if not cards:
         await update.message.reply_text("🤖 Non ci sono domande salvate nel database.")
         return
 
     # 🔍 MODALITÀ FILTRATA
     if query_terms:
-        filtered = []
-        for i, q in enumerate(knowledge_base["questions"], 1):
-            q_text = q["question"]
-            q_norm = normalize(q_text)
-
-            # tutti i termini devono comparire nella domanda normalizzata
-            if all(term in q_norm for term in query_terms if term):
-                filtered.append((i, q_text))
+        # tutti i termini devono comparire nella domanda normalizzata
+        # le domande cambiate di recente stanno in coda all'indice: si rimettono in ordine di ID
+        card_ids = sorted(i for ids in await run_search(filter_questions, bank, snap, query_terms) for i in ids)
+        filtered = [(card_id, snap.get(card_id).question) for card_id in card_ids]
 
         if not filtered:
             await update.message.reply_text(
@@ -297,8 +535,8 @@ async def questions_command(update: Update, context: CallbackContext) -> None:
     # 🔵 MODALITÀ NORMALE → tutte le domande
     header = "📌 *Domande che puoi farmi:*\n\n"
     lines = []
-    for i, q in enumerate(knowledge_base["questions"], 1):
-        lines.append(f"{i}. {q['question']}")
+    for q in cards:
+        lines.append(f"{q.id}. {q.question}")
 
     MAX_LEN = 3800
     current_block = header
@@ -320,7 +558,9 @@ async def questions_command(update: Update, context: CallbackContext) -> None:
 
 async def delete_command(update: Update, context: CallbackContext) -> None:
     """Elimina una domanda (e le sue risposte) in base al numero mostrato da /questions."""
-    if not knowledge_base["questions"]:
+    bank = await current_bank(context)
+
+    if not len(bank.snapshot):
         await update.message.reply_text("🤖 Il database è vuoto, non c'è nulla da eliminare.")
         return
 
@@ -329,58 +569,243 @@ async def delete_command(update: Update, context: CallbackContext) -> None:
         await update.message.reply_text("❌ Usa: /delete <numero_domanda>\nEsempio: /delete 3")
         return
 
-    raw_index = context.args[0]
+    raw_id = context.args[0]
 
     try:
-        index = int(raw_index)
+        card_id = int(raw_id)
     except ValueError:
         await update.message.reply_text("❌ Il parametro deve essere un numero intero. Esempio: /delete 3")
         return
 
-    # /questions numerava da 1, quindi convertiamo in indice di lista (0-based)
-    index -= 1
-
-    if index < 0 or index >= len(knowledge_base["questions"]):
+    # Eliminiamo la domanda: il numero è il suo ID, che non cambia per le altre domande
+    # (in un thread: il lock della banca può essere preso da una compattazione o da un /import)
+    removed_question = await asyncio.to_thread(bank.delete, card_id)
+    if removed_question is None:
         await update.message.reply_text("❌ Numero non valido. Controlla la lista con /questions.")
         return
 
-    # Prendiamo la domanda che stiamo per eliminare
-    removed_question = knowledge_base["questions"].pop(index)
+    schedule_maintenance(context, bank)
+
+    q_text = removed_question.question
+
+    await update.message.reply_text(
+        f"🗑️ Ho eliminato la domanda n.{card_id}:\n\n*{q_text}*",
+        parse_mode="Markdown"
+    )
+
+async def related_command(update: Update, context: CallbackContext) -> None:
+    """
+    Domande collegate (dai Collegamenti).
+    - /related            → all'ultima domanda a cui ho risposto
+    - /related <numero>   → alla domanda con quel numero
+    """
+    bank = await current_bank(context)
+    snap = bank.snapshot
+
+    if context.args:
+        try:
+            card_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Usa: /related <numero_domanda>\nEsempio: /related 3")
+            return
+    else:
+        card_id = context.user_data.get("last_question_id")
+        if card_id is None:
+            await update.message.reply_text("ℹ️ Fammi prima una domanda, oppure usa /related <numero>.")
+            return
+
+    await send_related(update.message, bank, snap, card_id)
+
+async def related_callback(update: Update, context: CallbackContext) -> None:
+    """Bottoni "rel:<banca>:<id>" (elenca le collegate) e "show:<banca>:<id>" (apre una domanda)."""
+    query = update.callback_query
+    await query.answer()
+
+    # i dati del bottone arrivano dal client: si controllano come gli argomenti di un comando
+    try:
+        kind, name, raw_id = query.data.split(":")
+        card_id = int(raw_id)
+    except ValueError:
+        await query.message.reply_text("❌ Bottone non valido.")
+        return
+
+    # la banca è nel bottone: un messaggio vecchio resta valido anche dopo /bank
+    if not BANK_NAME_RE.match(name) or not banks.exists(name):
+        await query.message.reply_text("❌ Banca non trovata. Controlla la lista con /bank.")
+        return
+
+    bank = await load_bank(context, name)
+    snap = bank.snapshot
+
+    if kind == "rel":
+        await send_related(query.message, bank, snap, card_id)
+        return
+
+    card = snap.get(card_id)
+    if card is None:
+        await query.message.reply_text("❌ Questa domanda non esiste più.")
+        return
+
+    if name == context.user_data.get("bank", DEFAULT_BANK):
+        context.user_data["last_question_id"] = card.id
+    # se era un suggerimento, la domanda in sospeso ha trovato la sua risposta
+    context.user_data.pop("pending_question", None)
+    await send_card(query.message, bank, snap, card)
+
+async def learn_callback(update: Update, context: CallbackContext) -> None:
+    """Bottone "Nessuna di queste" sotto i suggerimenti: solo ora si passa all'apprendimento."""
+    query = update.callback_query
+    await query.answer()
+
+    question = context.user_data.pop("pending_question", None)
+    if question is None:
+        await query.message.reply_text("ℹ️ Nessuna domanda in sospeso: riscrivila pure.")
+        return
+
+    context.user_data["waiting_for_answer"] = question
+    await query.message.reply_text(
+        "🤖 Non conosco la risposta. Digita la risposta per insegnarmela poi 'skip/q' per uscire."
+    )
+
+async def bank_command(update: Update, context: CallbackContext) -> None:
+    """
+    Gestisce le banche di domande (una per esame).
+    - /bank           → elenca le banche e indica quella attiva
+    - /bank <nome>    → passa a quella banca
+    """
+    active = context.user_data.get("bank", DEFAULT_BANK)
+
+    if not context.args:
+        lines = [
+            f"{'👉' if name == active else '▫️'} {name}"
+            for name in banks.names()
+        ]
+        await update.message.reply_text(
+            "🗂️ *Banche disponibili:*\n\n" + "\n".join(lines) + "\n\nUsa /bank <nome> per cambiare.",
+            parse_mode="Markdown"
+        )
+        return
+
+    name = context.args[0].lower()
+
+    if not BANK_NAME_RE.match(name) or not banks.exists(name):
+        await update.message.reply_text("❌ Banca non trovata. Controlla la lista con /bank.")
+        return
 
-    # Salviamo il JSON aggiornato
-    save_knowledge_base(knowledge_base)
+    # gli ID di quiz/flash/questions si riferiscono alla banca precedente
+    for key in ("quiz_mode", "quiz_id", "quiz_next", "flash_mode", "flash_id", "flash_next",
+                "questions_mode", "waiting_for_answer", "last_question_id", "pending_question"):
+        context.user_data.pop(key, None)
 
-    q_text = removed_question.get("question", "Domanda sconosciuta")
+    context.user_data["bank"] = name
+    bank = await load_bank(context, name)
 
     await update.message.reply_text(
-        f"🗑️ Ho eliminato la domanda n.{index + 1}:\n\n*{q_text}*",
+        f"🔀 Ora usi la banca *{name}* ({len(bank.snapshot)} domande).",
         parse_mode="Markdown"
     )
 
+async def duplicates_command(update: Update, context: CallbackContext) -> None:
+    """Elenca i gruppi di domande quasi uguali nella banca attiva, protetto da password."""
+    if not context.args:
+        await update.message.reply_text("🔐 Usa: /duplicates <password>")
+        return
+
+    if context.args[0] != ADMIN_PASSWORD:
+        await update.message.reply_text("⛔ Password errata.")
+        return
+
+    snap = (await current_bank(context)).snapshot
+    await ready(snap, "near_duplicates")
+    clusters = snap.near_duplicates.clusters()
+
+    if not clusters:
+        await update.message.reply_text("✨ Nessuna domanda quasi duplicata trovata.")
+        return
+
+    blocks = []
+    for group in clusters:
+        blocks.append("\n".join(f"{card_id}. {snap.get(card_id).question}" for card_id in group))
+
+    MAX_LEN = 3800
+    current_block = f"🔁 Gruppi di domande quasi uguali: {len(clusters)}\n\n"
+
+    # niente Markdown: le domande possono contenere * o _
+    for block in blocks:
+        if len(current_block) + len(block) + 2 > MAX_LEN:
+            await update.message.reply_text(current_block)
+            current_block = ""
+        current_block += block + "\n\n"
+
+    if current_block.strip():
+        await update.message.reply_text(current_block)
+
+async def load_command(update: Update, context: CallbackContext) -> None:
+    """Statistiche del controllo di ammissione (coda, richieste ammesse e scartate, latenze), protetto da password."""
+    if not context.args:
+        await update.message.reply_text("🔐 Usa: /load <password>")
+        return
+
+    if context.args[0] != ADMIN_PASSWORD:
+        await update.message.reply_text("⛔ Password errata.")
+        return
+
+    admission.queue_depth = context.application.update_queue.qsize()
+    # niente Markdown: i nomi dei tipi di richiesta non vanno interpretati
+    await update.message.reply_text(f"📈 Carico del bot\n\n{admission.report()}")
+
+async def import_command(update: Update, context: CallbackContext) -> None:
+    """
+    Importa in blocco un file di domande nella banca attiva.
+    Si usa inviando il file (CSV, JSONL o Markdown) con didascalia: /import <password>
+    """
+    parts = (update.message.caption or "").split()
+    document = update.message.document
+
+    if len(parts) < 2 or document is None:
+        await update.message.reply_text("📥 Invia il file (CSV, JSONL o Markdown) con didascalia: /import <password>")
+        return
+
+    if parts[1] != ADMIN_PASSWORD:
+        await update.message.reply_text("⛔ Password errata.")
+        return
+
+    filename = document.file_name or ""
+    if detect_format(filename) is None:
+        await update.message.reply_text("❌ Formato non supportato: usa .csv, .jsonl o .md")
+        return
+
+    bank = await current_bank(context)
+    telegram_file = await document.get_file()
+    data = bytes(await telegram_file.download_as_bytearray())
+
+    # parsing e salvataggio fuori dall'event loop: per file grossi ci vuole qualche secondo
+    report = await asyncio.to_thread(import_bytes, bank, data, filename)
+    schedule_maintenance(context, bank)
+
+    # niente Markdown: gli errori citano pezzi del file, che possono contenere * o _
+    await update.message.reply_text(f"📥 Importazione nella banca {bank.name}:\n\n{report.summary()}")
+
+@rate_limited("message", COST_MESSAGE)
 async def handle_message(update: Update, context: CallbackContext) -> None:
     """Risponde ai messaggi e apprende nuove risposte se necessario."""
     if not update.message or not update.message.text:
         return
 
+    bank = await current_bank(context)
+    snap = bank.snapshot
+
     user_input_raw = update.message.text.strip()
     user_input = user_input_raw.lower()
 
     # --- MODALITÀ: SCELTA DOMANDA PER NUMERO DOPO /questions ---
     if context.user_data.get("questions_mode"):
-        # se è solo un numero, interpretiamolo come indice della domanda
+        # se è solo un numero, interpretiamolo come ID della domanda (quello mostrato da /questions)
         if user_input_raw.isdigit():
-            index = int(user_input_raw) - 1  # /questions è 1-based
-            if 0 <= index < len(knowledge_base["questions"]):
-                q_obj = knowledge_base["questions"][index]
-                q_text = q_obj.get("question", "Domanda senza testo")
-                answers = q_obj.get("answers", [])
-
-                formatted = format_answer_from_list(answers)
-
-                await update.message.reply_text(
-                    f"❓ *Domanda n.{index + 1}:* {q_text}\n\n{formatted}",
-                    parse_mode="Markdown"
-                )
+            q_obj = snap.get(int(user_input_raw))
+            if q_obj is not None:
+                context.user_data["last_question_id"] = q_obj.id
+                await send_card(update.message, bank, snap, q_obj)
             else:
                 await update.message.reply_text(
                     "❌ Numero non valido. Controlla la lista con /questions."
@@ -399,44 +824,28 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         # comandi rapidi per uscire (testo, non comando)
         if user_input in ("stop", "esci", "fine", "quit"):
             context.user_data.pop("flash_mode", None)
-            context.user_data.pop("flash_index", None)
+            context.user_data.pop("flash_id", None)
+            context.user_data.pop("flash_next", None)
             await update.message.reply_text("🛑 Modalità flashcard terminata. Torniamo alle domande normali.")
             return
 
-        idx = context.user_data.get("flash_index")
+        question_obj = snap.get(context.user_data.get("flash_id"))
 
-        # sicurezza: se qualcosa va storto, scegliamo una nuova domanda
-        if idx is None or idx < 0 or idx >= len(knowledge_base["questions"]):
-            if not knowledge_base["questions"]:
+        # sicurezza: se qualcosa va storto (es. domanda eliminata), scegliamo una nuova domanda
+        if question_obj is None:
+            question_obj = snap.random_card()
+            if question_obj is None:
                 context.user_data.pop("flash_mode", None)
                 await update.message.reply_text("🤖 Database vuoto, impossibile continuare la modalità flash.")
                 return
-            idx = random.randrange(len(knowledge_base["questions"]))
-            context.user_data["flash_index"] = idx
-
-        question_obj = knowledge_base["questions"][idx]
-        question_text = question_obj.get("question", "Domanda senza testo")
-        answers = question_obj.get("answers", [])
+            context.user_data["flash_id"] = question_obj.id
 
-        solution = format_answer_from_list(answers)
+        # risposta della flashcard corrente + subito la prossima (già pronte), in un solo messaggio
+        turn = await take_turn(context, snap, question_obj, "flash")
+        await reply_parts(update.message, [turn.solution, turn.next_prompt])
 
-        # 1️⃣ Mostra la risposta della flashcard corrente
-        await update.message.reply_text(
-            f"✅ *Risposta flash:*\n*{question_text}*\n\n{solution}",
-            parse_mode="Markdown"
-        )
-
-        # 2️⃣ Subito nuova domanda flash
-        new_index = random.randrange(len(knowledge_base["questions"]))
-        context.user_data["flash_index"] = new_index
-        new_q = knowledge_base["questions"][new_index].get("question", "Domanda senza testo")
-
-        await update.message.reply_text(
-            f"⚡ Prossima flashcard:\n❓ *{new_q}*\n\n"
-            "✏️ Scrivi qualsiasi cosa per vedere la risposta.\n"
-            "🛑 /stopflash per uscire.",
-            parse_mode="Markdown"
-        )
+        context.user_data["flash_id"] = turn.next_card.id
+        prefetch_turn(context, snap, turn.next_card, "flash")
         return
 
     
@@ -445,63 +854,59 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
         # comandi rapidi dentro il quiz
         if user_input in ("/stopquiz", "stop", "esci", "fine", "quit"):
             context.user_data.pop("quiz_mode", None)
-            context.user_data.pop("quiz_index", None)
+            context.user_data.pop("quiz_id", None)
+            context.user_data.pop("quiz_next", None)
             await update.message.reply_text("🛑 Modalità quiz terminata. Torniamo alle domande normali.")
             return
 
-        # salto domanda
+        # salto domanda (la prossima è già stata scelta in anticipo, se è ancora valida;
+        # altrimenti se ne sceglie una: niente soluzione da formattare né valutatore da costruire)
         if user_input in ("skip", "s"):
-            if not knowledge_base["questions"]:
+            current = snap.get(context.user_data.get("quiz_id"))
+            turn = await prefetched_turn(context, snap, current, "quiz")
+            question_obj = turn.next_card if turn else snap.random_card()
+            if question_obj is None:
                 await update.message.reply_text("🤖 Database vuoto, non posso cambiare domanda.")
                 return
 
-            new_index = random.randrange(len(knowledge_base["questions"]))
-            context.user_data["quiz_index"] = new_index
-            question_obj = knowledge_base["questions"][new_index]
-            question_text = question_obj.get("question", "Domanda senza testo")
+            context.user_data["quiz_id"] = question_obj.id
+            prefetch_turn(context, snap, question_obj, "quiz")
+            question_text = question_obj.question
 
             await update.message.reply_text(
-                f"⏭️ Nuova domanda n.{new_index + 1}:\n*{question_text}*",
+                f"⏭️ Nuova domanda n.{question_obj.id}:\n*{question_text}*",
                 parse_mode="Markdown",
             )
             return
 
         # risposta normale del quiz
-        idx = context.user_data.get("quiz_index")
-        if idx is None or idx < 0 or idx >= len(knowledge_base["questions"]):
+        question_obj = snap.get(context.user_data.get("quiz_id"))
+        if question_obj is None:
             await update.message.reply_text("⚠️ Qualcosa è andato storto con il quiz. Riprova con /quiz.")
             context.user_data.pop("quiz_mode", None)
-            context.user_data.pop("quiz_index", None)
+            context.user_data.pop("quiz_id", None)
+            context.user_data.pop("quiz_next", None)
             return
 
-        question_obj = knowledge_base["questions"][idx]
-        question_text = question_obj.get("question", "Domanda senza testo")
-        answers = question_obj.get("answers", [])
-
-        # mostriamo la risposta dell'utente + la soluzione ufficiale
-        solution = format_answer_from_list(answers)
-
-        await update.message.reply_text(
-            f"✏️ *La tua risposta:*\n{user_input_raw}",
-            parse_mode="Markdown"
-        )
-
-        await update.message.reply_text(
-            f"✅ *Soluzione ufficiale per la domanda n.{idx + 1}:*\n*{question_text}*\n\n{solution}",
-            parse_mode="Markdown"
-        )
-
-        # subito una nuova domanda
-        new_index = random.randrange(len(knowledge_base["questions"]))
-        context.user_data["quiz_index"] = new_index
-        new_q = knowledge_base["questions"][new_index].get("question", "Domanda senza testo")
-
-        await update.message.reply_text(
-            f"🧠 Prossima domanda n.{new_index + 1}:\n*{new_q}*\n\n"
-            "✏️ Scrivi la tua risposta oppure *skip* per passare.\n"
-            "🛑 /stopquiz per uscire.",
-            parse_mode="Markdown"
-        )
+        # soluzione ufficiale e prossima domanda sono già pronte: resta solo il punteggio
+        await ready(snap, "grader")
+        turn = await take_turn(context, snap, question_obj, "quiz")
+        score, missing = snap.grader.grade(question_obj, user_input_raw)
+        record_quiz_score(context, question_obj.id, score)
+
+        feedback = f"📊 *Punteggio:* {score}%"
+        if missing:
+            feedback += f"\n🔑 Parole chiave mancanti: {', '.join(missing)}"
+
+        # risposta dell'utente (con il punteggio) + soluzione + nuova domanda, nel minor numero di messaggi
+        await reply_parts(update.message, [
+            f"✏️ *La tua risposta:*\n{user_input_raw}\n\n{feedback}",
+            turn.solution,
+            turn.next_prompt,
+        ])
+
+        context.user_data["quiz_id"] = turn.next_card.id
+        prefetch_turn(context, snap, turn.next_card, "quiz")
         return
     
     # --- MODALITÀ APPRENDIMENTO ---
@@ -515,41 +920,73 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
             del context.user_data["waiting_for_answer"]
             return
 
-        # Aggiungi la risposta
-        for q in knowledge_base["questions"]:
-            if q["question"].lower() == user_question.lower():
-                q["answers"].append(user_answer)
-                break
+        # Se c'è già una domanda uguale o quasi uguale ("cosa è il tuel" / "Cos'è il TUEL?")
+        # la risposta va lì, invece di creare un doppione
+        await ready(snap, "questions", "near_duplicates")
+        similar = snap.find(user_question) or snap.similar(user_question)
+        # le scritture in un thread: aspettare il lock della banca non deve fermare gli altri utenti
+        card = await asyncio.to_thread(bank.append_answer, similar.id, user_answer) if similar else None
+
+        if card is None:
+            await asyncio.to_thread(bank.add_answer, user_question, user_answer)
+            await update.message.reply_text(
+                f"✅ Grazie! Ho memorizzato la risposta:\n\n*{user_question} ➝ {user_answer}*",
+                parse_mode="Markdown",
+            )
         else:
-            knowledge_base["questions"].append(
-                {"question": user_question, "answers": [user_answer]}
+            await update.message.reply_text(
+                f"✅ Grazie! Ho aggiunto la risposta alla domanda n.{card.id}:\n\n*{card.question} ➝ {user_answer}*",
+                parse_mode="Markdown",
             )
-
-        save_knowledge_base(knowledge_base)
-
-        await update.message.reply_text(
-            f"✅ Grazie! Ho memorizzato la risposta:\n\n*{user_question} ➝ {user_answer}*",
-            parse_mode="Markdown",
-        )
+        schedule_maintenance(context, bank)
 
         del context.user_data["waiting_for_answer"]
         return
 
     # --- DOMANDA NORMALE ---
-    best_match = find_best_match(user_input, knowledge_base)
+    context.user_data.pop("pending_question", None)
+    best_id, fuzzy = await run_match(bank, snap, user_input, SUGGESTIONS)
+    suggestions = []
+    if best_id is None:
+        # ultima possibilità prima di chiedere la risposta: una domanda con lo stesso significato
+        # (in un thread: la prima volta per ogni versione si costruisce la matrice dei vettori);
+        # intanto si scelgono i suggerimenti tra le più vicine e i candidati del fuzzy match
+        best_id, suggestions = await asyncio.to_thread(
+            snap.semantic.resolve, user_input, SUGGESTIONS, [card_id for card_id, _ in fuzzy]
+        )
+    best_card = snap.get(best_id) if best_id is not None else None
 
-    if best_match:
-        answers = get_answer_for_question(best_match, knowledge_base)
+    if best_card:
+        answers = best_card.answers
         if answers:
             response = format_answer_from_list(answers)
 
             # 🔹 salvo l'ultima domanda a cui ho risposto
-            context.user_data["last_question"] = best_match
+            context.user_data["last_question_id"] = best_card.id
 
-            await update.message.reply_text(f"🤖 {response}", parse_mode="Markdown")
+            await update.message.reply_text(
+                f"🤖 {response}",
+                parse_mode="Markdown",
+                reply_markup=await related_keyboard(bank, snap, best_card.id)
+            )
             return
 
 
+    # Non trovata, ma qualcosa di simile c'è → "Forse intendevi…" (si impara solo se nessuna va bene)
+    candidates = [c for c in (snap.get(card_id) for card_id, _ in suggestions) if c is not None]
+    if candidates:
+        context.user_data["pending_question"] = user_input_raw
+        buttons = [
+            [InlineKeyboardButton(f"{c.id}. {c.question}"[:60], callback_data=f"show:{bank.name}:{c.id}")]
+            for c in candidates
+        ]
+        buttons.append([InlineKeyboardButton("❌ Nessuna di queste", callback_data="learn")])
+        await update.message.reply_text(
+            "🤔 Non ho una risposta sicura. Forse intendevi:",
+            reply_markup=InlineKeyboardMarkup(buttons)
+        )
+        return
+
     # Non trovata → chiedi risposta
     await update.message.reply_text(
         "🤖 Non conosco la risposta. Digita la risposta per insegnarmela poi 'skip/q' per uscire."
@@ -558,14 +995,23 @@ async def handle_message(update: Update, context: CallbackContext) -> None:
     context.user_data["waiting_for_answer"] = user_input_raw
 
 
-# Carico il DB a livello globale
-knowledge_base = load_knowledge_base()
+# Le banche si caricano solo al primo uso (e si scaricano se non servono)
+banks = BankManager(DB_FILE, BANKS_DIR, BANKS_MEMORY_MB * 1024 * 1024)
+
+# Secchi di gettoni e statistiche del controllo di ammissione
+admission = Admission(USER_RATE, USER_BURST, GLOBAL_RATE, GLOBAL_BURST, MAX_QUEUE)
+
+# Pool di processi per la ricerca, creato solo all'avvio del bot
+search_pool = None
 
 
 if __name__ == "__main__":
     if not TOKEN:
         raise RuntimeError("❌ La variabile d'ambiente TOKEN non è impostata!")
 
+    if SEARCH_WORKERS > 0:
+        search_pool = ProcessPoolExecutor(max_workers=SEARCH_WORKERS)
+
     app = Application.builder().token(TOKEN).build()
 
     # Comandi
@@ -576,8 +1022,21 @@ if __name__ == "__main__":
     app.add_handler(CommandHandler("delete", delete_command))
     app.add_handler(CommandHandler("quiz", quiz_command))
     app.add_handler(CommandHandler("stopquiz", stopquiz_command))
+    app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CommandHandler("flash", flash_command))
     app.add_handler(CommandHandler("stopflash", stopflash_command))
+    app.add_handler(CommandHandler("bank", bank_command))
+    app.add_handler(CommandHandler("duplicates", duplicates_command))
+    app.add_handler(CommandHandler("related", related_command))
+    app.add_handler(CommandHandler("load", load_command))
+
+    # Bottoni delle domande collegate (e dei suggerimenti, che aprono una domanda con show:)
+    app.add_handler(CallbackQueryHandler(related_callback, pattern=r"^(rel|show):"))
+    # "Nessuna di queste" sotto i suggerimenti
+    app.add_handler(CallbackQueryHandler(learn_callback, pattern=r"^learn$"))
+
+    # Importazione in blocco: file con didascalia /import <password>
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import\b"), import_command))
 
     # Messaggi normali
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -585,6 +1044,9 @@ if __name__ == "__main__":
     print("🤖 Bot avviato in polling...")
     app.run_polling()
 
+    if search_pool is not None:
+        search_pool.shutdown()
+
 
 
 
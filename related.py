@@ -0,0 +1,253 @@
+from collections import deque
+
+from grading import STEM_LEN, STOPWORDS
+from kb_search import normalize
+
+
+# Quante domande collegate mostrare al massimo per una card
+MAX_RELATED = 8
+
+# Un termine dei Collegamenti che compare in troppe domande ("Costituzione", "bilancio"…)
+# non dice nulla su quale sia quella collegata: lo ignoriamo
+MAX_TERM_HITS = 10
+
+
+def phrase(text: str) -> tuple[str, ...]:
+    """
+    Testo → sequenza di radici senza parole vuote, usata sia per i termini sia per le domande:
+    "organi del Comune" e "Quali sono gli organi del comune?" → (organi, comune) dentro (quali, organi, comune).
+    """
+    return tuple(w[:STEM_LEN] for w in normalize(text).split() if w not in STOPWORDS)
+
+
+def link_terms(answers) -> list[str]:
+    """I termini elencati nelle righe "Collegamenti: a, b, c" di una card."""
+    out = []
+    for a in answers:
+        if a.lower().startswith("collegamenti:"):
+            out.extend(t.strip() for t in a[len("collegamenti:"):].split(",") if t.strip())
+    return out
+
+
+class PhraseMatcher:
+    """
+    Automa di Aho–Corasick sulle parole: trova in un solo passaggio sul testo
+    tutte le frasi (sequenze di radici) che vi compaiono, qualunque sia il loro numero.
+    """
+
+    def __init__(self, phrases):
+        self._goto: list[dict[str, int]] = [{}]
+        self._out: list[list[int]] = [[]]
+        for pid, words in enumerate(phrases):
+            state = 0
+            for w in words:
+                nxt = self._goto[state].get(w)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][w] = nxt
+                    self._goto.append({})
+                    self._out.append([])
+                state = nxt
+            if words:
+                self._out[state].append(pid)
+
+        # link di fallimento in ampiezza (i figli della radice ricadono sulla radice):
+        # ogni stato eredita le uscite del suo fallback
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for w, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and w not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(w, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def scan(self, words) -> set[int]:
+        """Gli id delle frasi che compaiono (come parole consecutive) in words."""
+        found = set()
+        state = 0
+        for w in words:
+            while state and w not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(w, 0)
+            found.update(self._out[state])
+        return found
+
+
+class RelatedGraph:
+    """
+    Grafo delle domande collegate, ricavato dalle righe "Collegamenti:".
+    Un termine dei Collegamenti della card A che compare nel testo della domanda B
+    collega A a B (e, in senso inverso, B ad A).
+
+    Si tiene per ogni termine chi lo cita (sources) e in quali domande compare (hits),
+    più un indice parola → domande per trovare subito dove compare un termine nuovo:
+    aggiungere, cambiare o eliminare una card tocca solo i suoi termini e le frasi della
+    sua domanda. Le liste di adiacenza si calcolano alla prima richiesta e restano in
+    cache finché una modifica non le riguarda: chiedere le collegate di una card è O(1).
+    """
+
+    def __init__(self):
+        self._patterns: dict[tuple[str, ...], int] = {}  # termine (frase) → id
+        self._phrases: list[tuple[str, ...]] = []         # id → termine
+        self._sources: dict[int, dict[int, None]] = {}    # termine → card che lo citano (in ordine)
+        self._hits: dict[int, set[int]] = {}              # termine → domande che lo contengono
+        self._terms: dict[int, list[int]] = {}            # card → i suoi termini, in ordine
+        self._questions: dict[int, tuple[str, ...]] = {}  # card → frase della sua domanda
+        self._words: dict[str, set[int]] = {}             # radice → domande che la contengono
+        self._longest = 0
+        self._adjacency: dict[int, tuple[int, ...]] = {}
+        self._generation = 0  # cambia a ogni modifica: una lista calcolata prima non va in cache
+
+    @classmethod
+    def build(cls, cards) -> "RelatedGraph":
+        graph = cls()
+        cards = list(cards)
+        for card in cards:
+            graph._add_question(card.id, phrase(card.question))
+            for term in link_terms(card.answers):
+                words = phrase(term)
+                if words:
+                    pid = graph._pattern(words, scan=False)
+                    graph._sources[pid][card.id] = None
+                    graph._terms.setdefault(card.id, []).append(pid)
+
+        # un solo passaggio su ogni domanda trova tutti i termini che contiene
+        matcher = PhraseMatcher(graph._phrases)
+        for card in cards:
+            for pid in matcher.scan(graph._questions[card.id]):
+                graph._hits[pid].add(card.id)
+        return graph
+
+    def _pattern(self, words: tuple[str, ...], scan: bool = True) -> int:
+        """Id del termine, registrandolo se è nuovo (con scan, cercandolo nelle domande)."""
+        pid = self._patterns.get(words)
+        if pid is None:
+            pid = len(self._phrases)
+            self._patterns[words] = pid
+            self._phrases.append(words)
+            self._sources[pid] = {}
+            self._hits[pid] = self._find(words) if scan else set()
+            self._longest = max(self._longest, len(words))
+        return pid
+
+    def _find(self, words: tuple[str, ...]) -> set[int]:
+        """Le domande che contengono la frase: si parte dalla radice più rara e si verifica."""
+        postings = sorted((self._words.get(w, set()) for w in set(words)), key=len)
+        if len(words) == 1:
+            return set(postings[0])
+        found = set()
+        n = len(words)
+        for card_id in postings[0].intersection(*postings[1:]):
+            text = self._questions[card_id]
+            if any(text[i:i + n] == words for i in range(len(text) - n + 1)):
+                found.add(card_id)
+        return found
+
+    def _matches(self, text: tuple[str, ...]) -> set[int]:
+        """I termini noti che compaiono nella frase (finestre fino al termine più lungo)."""
+        found = set()
+        for i in range(len(text)):
+            for j in range(i + 1, min(i + self._longest, len(text)) + 1):
+                pid = self._patterns.get(text[i:j])
+                if pid is not None:
+                    found.add(pid)
+        return found
+
+    def _add_question(self, card_id: int, text: tuple[str, ...]):
+        self._questions[card_id] = text
+        for w in set(text):
+            self._words.setdefault(w, set()).add(card_id)
+
+    def _forget(self, card_ids):
+        for card_id in card_ids:
+            self._adjacency.pop(card_id, None)
+
+    def _hit_changed(self, pid: int, before: int):
+        """Le domande che contengono il termine sono cambiate (prima erano before)."""
+        # sopra MAX_TERM_HITS il termine non collega nulla: cambia qualcosa solo se ci passa
+        if min(before, len(self._hits[pid])) <= MAX_TERM_HITS:
+            self._forget(self._sources[pid])
+            self._forget(self._hits[pid])
+
+    def _source_changed(self, pid: int):
+        """Una card ha cominciato o smesso di citare il termine."""
+        if len(self._hits[pid]) <= MAX_TERM_HITS:
+            self._forget(self._hits[pid])
+
+    def add(self, card):
+        self._generation += 1
+        text = phrase(card.question)
+        self._add_question(card.id, text)
+        for pid in self._matches(text):
+            before = len(self._hits[pid])
+            self._hits[pid].add(card.id)
+            self._hit_changed(pid, before)
+        for term in link_terms(card.answers):
+            words = phrase(term)
+            if words:
+                pid = self._pattern(words)
+                self._sources[pid][card.id] = None
+                self._terms.setdefault(card.id, []).append(pid)
+                self._source_changed(pid)
+        self._adjacency.pop(card.id, None)
+
+    def remove(self, card_id: int):
+        self._generation += 1
+        text = self._questions.pop(card_id, None)
+        if text is None:
+            return
+        for pid in self._terms.pop(card_id, ()):
+            self._sources[pid].pop(card_id, None)
+            self._source_changed(pid)
+        for pid in self._matches(text):
+            before = len(self._hits[pid])
+            self._hits[pid].discard(card_id)
+            self._hit_changed(pid, before)
+        for w in set(text):
+            cards = self._words.get(w)
+            if cards is not None:
+                cards.discard(card_id)
+                if not cards:
+                    del self._words[w]
+        self._adjacency.pop(card_id, None)
+
+    def update(self, before, after):
+        """Card aggiunta (before None), cambiata o eliminata (after None)."""
+        if (before is not None and after is not None and before.question == after.question
+                and link_terms(before.answers) == link_terms(after.answers)):
+            return
+        if before is not None:
+            self.remove(before.id)
+        if after is not None:
+            self.add(after)
+
+    def get(self, card_id: int) -> tuple[int, ...]:
+        """ID delle domande collegate (le più vicine prima)."""
+        linked = self._adjacency.get(card_id)
+        if linked is not None:
+            return linked
+        generation = self._generation
+        text = self._questions.get(card_id)
+        if text is None:
+            return ()
+
+        # prima quelle citate dai suoi Collegamenti, poi quelle che citano lei (le più vecchie prima)
+        outgoing = []
+        for pid in self._terms.get(card_id, ()):
+            targets = self._hits[pid]
+            if len(targets) <= MAX_TERM_HITS:
+                outgoing.extend(sorted(targets))
+        incoming = set()
+        for pid in self._matches(text):
+            if len(self._hits[pid]) <= MAX_TERM_HITS:
+                incoming.update(self._sources[pid])
+        linked = dict.fromkeys(outgoing + sorted(incoming))
+        linked.pop(card_id, None)
+        linked = tuple(linked)[:MAX_RELATED]
+        if generation == self._generation:
+            self._adjacency[card_id] = linked
+        return linked
@@ -0,0 +1,186 @@
+import heapq
+import sys
+import zlib
+from functools import lru_cache
+
+import numpy as np
+
+from grading import STOPWORDS, _sections
+from kb_search import normalize
+
+
+# Dimensione dei vettori: ogni n-gramma di caratteri finisce (con un segno) in una di DIM colonne
+DIM = 512
+NGRAMS = (3, 4)
+
+# La domanda pesa più della Sintesi (che serve a trovare una domanda con le parole della sua risposta)
+SINTESI_WEIGHT = 0.5
+
+# Similarità coseno minima per considerare trovata una domanda…
+SEMANTIC_MIN = 0.45
+# …e per proporla come suggerimento ("forse intendevi…")
+SUGGEST_MIN = 0.2
+
+
+@lru_cache(maxsize=1 << 16)
+def _word_slots(word: str) -> tuple[tuple[int, float], ...]:
+    """(colonna, segno) di ogni n-gramma di una parola: le parole si ripetono, gli hash si calcolano una volta."""
+    padded = f" {word} "
+    out = []
+    for n in NGRAMS:
+        for i in range(len(padded) - n + 1):
+            h = zlib.crc32(padded[i:i + n].encode("utf-8"))
+            # il bit più alto decide il segno: le collisioni si compensano invece di sommarsi
+            out.append((h % DIM, 1.0 if h & 0x80000000 else -1.0))
+    return tuple(out)
+
+
+def _grams(text: str, weight: float, out: dict[int, float]):
+    for word in normalize(text).split():
+        if word in STOPWORDS:
+            continue
+        for key, sign in _word_slots(word):
+            out[key] = out.get(key, 0.0) + sign * weight
+
+
+def vector(text: str, sintesi: str = "") -> np.ndarray:
+    """Vettore (normalizzato) degli n-grammi di caratteri di un testo, con l'hashing trick."""
+    counts: dict[int, float] = {}
+    _grams(text, 1.0, counts)
+    if sintesi:
+        _grams(sintesi, SINTESI_WEIGHT, counts)
+    vec = np.zeros(DIM, dtype=np.float32)
+    if counts:
+        vec[list(counts)] = list(counts.values())
+        norm = np.linalg.norm(vec)
+        if norm:
+            vec /= norm
+    return vec
+
+
+def _card_vector(card) -> np.ndarray:
+    return vector(card.question, _sections(card.answers)[0])
+
+
+class SemanticIndex:
+    """
+    Ricerca "per significato" senza modelli né rete: trova "Qual è il ruolo della Giunta comunale?"
+    anche per "la giunta è l'organo esecutivo", che con la domanda ha in comune una parola sola
+    ma ne ha tante con la sua Sintesi.
+    I vettori stanno in una matrice NumPy (una riga per domanda) e la richiesta si confronta
+    con tutte: con 10.000 domande è un prodotto matrice-vettore da circa 1 ms. Tabelle LSH
+    (iperpiani casuali) abbastanza fitte da non perdere la più simile intorno a SEMANTIC_MIN
+    lasciavano da confrontare più di metà delle righe, e costavano di più.
+    Una domanda nuova è una riga in fondo (la matrice cresce di un quarto alla volta), una cambiata
+    riscrive la sua riga, un'eliminata la azzera: nessuna costa più di una card.
+    """
+
+    def __init__(self, ids: list[int], matrix: np.ndarray):
+        self.ids: list[int | None] = list(ids)  # None = riga di una domanda eliminata
+        self._matrix = matrix
+        self._n = len(self.ids)
+        self._rows = {card_id: row for row, card_id in enumerate(self.ids)}
+        self._alive = np.array([card_id is not None for card_id in self.ids], dtype=bool)
+
+    @classmethod
+    def build(cls, cards) -> "SemanticIndex":
+        ids = []
+        rows = []
+        for card in cards:
+            ids.append(card.id)
+            rows.append(_card_vector(card))
+        matrix = np.vstack(rows) if rows else np.zeros((0, DIM), dtype=np.float32)
+        return cls(ids, matrix)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._matrix[:self._n]
+
+    @property
+    def nbytes(self) -> int:
+        """Byte occupati: la matrice (con le righe di scorta), la lista degli ID e l'indice delle righe."""
+        return self._matrix.nbytes + self._alive.nbytes + sys.getsizeof(self.ids) + sys.getsizeof(self._rows)
+
+    def add(self, card):
+        row = self._n
+        if row == len(self._matrix):
+            size = row + max(row // 4, 64)
+            grown = np.zeros((size, DIM), dtype=np.float32)
+            grown[:row] = self._matrix[:row]
+            alive = np.zeros(size, dtype=bool)
+            alive[:row] = self._alive[:row]
+            self._matrix, self._alive = grown, alive
+        self._matrix[row] = _card_vector(card)
+        self._alive[row] = True
+        self.ids.append(card.id)
+        self._rows[card.id] = row
+        # la riga diventa visibile a chi cerca solo adesso, quando è completa
+        self._n = row + 1
+
+    def remove(self, card_id: int):
+        row = self._rows.pop(card_id, None)
+        if row is None:
+            return
+        self._alive[row] = False
+        self.ids[row] = None
+        self._matrix[row] = 0
+
+    def update(self, before, after):
+        """Card aggiunta (before None), cambiata o eliminata (after None)."""
+        if before is None:
+            self.add(after)
+        elif after is None:
+            self.remove(before.id)
+        elif (before.question != after.question
+              or _sections(before.answers)[0] != _sections(after.answers)[0]):
+            row = self._rows.get(after.id)
+            if row is None:
+                return
+            self._matrix[row] = _card_vector(after)
+
+    def search(self, text: str, k: int = 1) -> list[tuple[int, float]]:
+        """Le k domande più simili come (ID, similarità), dalla più simile."""
+        return self._search(vector(text), k)
+
+    def _search(self, vec: np.ndarray, k: int) -> list[tuple[int, float]]:
+        if not vec.any():
+            return []
+        n = self._n  # prima il numero di righe: la matrice ne ha sempre almeno tante
+        scores = self._matrix[:n] @ vec
+        scores[~self._alive[:n]] = -np.inf
+        if k < n:
+            # tutte le righe almeno simili quanto la k-esima: i pari merito al confine restano in gara
+            rows = np.flatnonzero(scores >= np.partition(scores, n - k)[n - k])
+        else:
+            rows = np.arange(n)
+        # a parità di similarità vince la domanda inserita prima
+        ids = self.ids
+        best = heapq.nlargest(k, ((score, -r) for score, r in zip(scores[rows].tolist(), rows.tolist())
+                                  if score != -np.inf and ids[r] is not None))
+        return [(ids[-neg_row], score) for score, neg_row in best]
+
+    def best(self, text: str) -> int | None:
+        """L'ID della domanda più simile, se abbastanza simile."""
+        return self.resolve(text)[0]
+
+    def resolve(self, text: str, k: int = 0, extra=()) -> tuple[int | None, list[tuple[int, float]]]:
+        """
+        (ID della domanda più simile se abbastanza simile, altrimenti None;
+        fino a k suggerimenti (ID, similarità) tra le più simili e gli ID in extra,
+        es. i candidati del fuzzy match, ordinati per similarità).
+        """
+        vec = vector(text)
+        found = self._search(vec, max(k, 1))
+        if found and found[0][1] >= SEMANTIC_MIN:
+            return found[0][0], []
+        if not k:
+            return None, []
+
+        scored = dict(found)
+        rows = [row for row in (self._rows.get(card_id) for card_id in extra if card_id not in scored)
+                if row is not None]
+        if rows:
+            for row, score in zip(rows, (self._matrix[rows] @ vec).tolist()):
+                scored[self.ids[row]] = score
+        ranked = sorted((item for item in scored.items() if item[1] >= SUGGEST_MIN), key=lambda item: -item[1])
+        return None, ranked[:k]
@@ -0,0 +1,64 @@
+"""
+I quasi-duplicati trovati con MinHash/LSH devono essere quelli che si troverebbero confrontando
+le parole chiave con tutte le domande (Jaccard sopra DUP_THRESHOLD).
+
+    python -m pytest -q test_dedup.py
+"""
+import json
+import os
+import random
+
+from dedup import DUP_THRESHOLD, Fingerprint, NearDuplicateIndex, features, jaccard
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _questions(rng: random.Random, n: int) -> list[str]:
+    with open(os.path.join(HERE, "db.json"), encoding="utf-8") as file:
+        base = json.load(file)["questions"]
+    words = sorted({w for q in base for text in [q["question"], *q["answers"]] for w in text.split() if len(w) > 3})
+    return [q["question"] for q in base] + [" ".join(rng.sample(words, 6)) + "?" for _ in range(n)]
+
+
+def _exact(feats: dict[int, frozenset[str]], question: str) -> int | None:
+    mine = features(question)
+    best, best_sim = None, 0.0
+    for key in sorted(feats):
+        sim = jaccard(mine, feats[key])
+        if sim >= DUP_THRESHOLD and sim > best_sim:
+            best, best_sim = key, sim
+    return best
+
+
+def test_find_matches_exhaustive_jaccard():
+    rng = random.Random(3)
+    questions = _questions(rng, 3000)
+    index = NearDuplicateIndex()
+    for key, question in enumerate(questions):
+        index.add(key, question)
+    feats = {key: features(q) for key, q in enumerate(questions)}
+
+    found = 0
+    for question in rng.sample(questions, 400) + ["cosa è il tuel", "Cos'è il TUEL?", "tutt'altro argomento"]:
+        words = question.split()
+        rng.shuffle(words)
+        for variant in (question, " ".join(words), " ".join(words[:-1])):
+            expected = _exact(feats, variant)
+            assert index.find(variant) == expected, variant
+            assert index.find(variant, Fingerprint(variant)) == expected, variant
+            found += expected is not None
+    assert found > 800
+
+    # tolte le domande, i loro bucket si svuotano e non vengono più trovate
+    for key in range(len(questions)):
+        index.remove(key)
+    assert index.find(questions[0]) is None
+    assert not any(index._buckets)
+
+
+def test_clusters():
+    index = NearDuplicateIndex.build([])
+    for key, question in enumerate(["Cos'è il TUEL?", "cosa è il tuel", "Che cos'è il TUEL", "Cos'è la SCIA?",
+                                    "Art. 5", "Art. 15"]):
+        index.add(key, question)
+    assert index.clusters() == [[0, 1, 2]]
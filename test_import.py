@@ -0,0 +1,173 @@
+"""
+Lettori di kb_import (CSV, JSONL, Markdown), validate e import_stream: le righe sbagliate si
+scartano una per una, un file illeggibile non importa nulla e non fa cadere l'importazione.
+
+    python -m pytest -q test_import.py
+"""
+import gzip
+import io
+import json
+
+import pytest
+
+import kb_import
+import kb_store
+from kb_import import import_bytes, import_stream, read_csv, read_jsonl, read_markdown, validate
+
+
+def _bank(tmp_path) -> kb_store.Bank:
+    path = tmp_path / "db.json"
+    path.write_text(json.dumps({"questions": [
+        {"question": "Cos'è il TUEL?", "answers": ["Sintesi: Il testo unico degli enti locali."]},
+    ]}), encoding="utf-8")
+    return kb_store.Bank("db", str(path))
+
+
+def test_validate():
+    assert validate("Cos'è la SCIA?", ["Sintesi: una segnalazione", "Collegamenti: DPR 380"]) is None
+    assert validate("  ", ["Sintesi: x"]) == "domanda vuota"
+    assert validate("Domanda?", ["Approfondimento: x"]) == "manca la Sintesi"
+    assert validate("Domanda?", ["Sintesi: x", "sintesi: y"]) == "Sintesi ripetuta"
+    assert validate("Domanda?", ["Sintesi:   "]) == "Sintesi vuota"
+    assert validate("Domanda?", ["Sintesi: x", "Note: y"]).startswith("risposta senza etichetta valida")
+    assert validate("Domanda?", ["Sintesi: x", "testo libero"]).startswith("risposta senza etichetta valida")
+
+
+def test_read_csv():
+    stream = io.StringIO("Domanda,Sintesi,Approfondimento,Collegamenti\n"
+                         "Cos'è la SCIA?,Una segnalazione,,DPR 380\n"
+                         "Chi è il RUP?,,Il responsabile,\n")
+    assert list(read_csv(stream)) == [
+        (2, "Cos'è la SCIA?", ["Sintesi: Una segnalazione", "Collegamenti: DPR 380"]),
+        (3, "Chi è il RUP?", ["Approfondimento: Il responsabile"]),
+    ]
+
+
+def test_read_jsonl():
+    lines = [
+        json.dumps({"question": "A?", "answers": ["Sintesi: a"]}),
+        "",
+        json.dumps({"domanda": "B?", "sintesi": "b", "collegamenti": "c", "altro": 1}),
+        "{non json",
+        json.dumps(["C?"]),
+        json.dumps({"question": "D?", "answers": "Sintesi: d"}),
+        json.dumps({"question": 123, "sintesi": "x"}),
+        json.dumps({"question": ["E?"], "sintesi": "x"}),
+    ]
+    records = list(read_jsonl(io.StringIO("\n".join(lines) + "\n")))
+    assert records[:2] == [(1, "A?", ["Sintesi: a"]), (3, "B?", ["Sintesi: b", "Collegamenti: c"])]
+    assert [(line, question) for line, question, _ in records[2:]] == [(4, None), (5, None), (6, None), (7, None), (8, None)]
+    assert records[2][2].startswith("JSON non valido")
+    assert records[3][2] == "la riga non è un oggetto JSON"
+    assert records[4][2] == "answers deve essere una lista di testi"
+    assert records[5][2] == records[6][2] == "question deve essere un testo"
+
+
+def test_read_markdown():
+    stream = io.StringIO("# Esame\n\n"
+                         "## Cos'è la SCIA?\n"
+                         "**Sintesi:** una segnalazione\n"
+                         "che continua qui.\n"
+                         "Collegamenti: DPR 380\n\n"
+                         "## Chi è il RUP?\n"
+                         "testo senza etichetta\n")
+    assert list(read_markdown(stream)) == [
+        (3, "Cos'è la SCIA?", ["Sintesi: una segnalazione che continua qui.", "Collegamenti: DPR 380"]),
+        (8, "Chi è il RUP?", ["testo senza etichetta"]),
+    ]
+
+
+def test_import_stream_skips_bad_rows(tmp_path):
+    bank = _bank(tmp_path)
+    lines = [
+        {"question": "Cos'è la SCIA?", "sintesi": "Una segnalazione."},
+        {"question": 123, "sintesi": "x"},
+        {"question": "Senza sintesi?", "approfondimento": "x"},
+        {"question": "cos'è il tuel", "sintesi": "Il testo unico.", "approfondimento": "Il D.Lgs. 267/2000."},
+        {"question": "Cos'è la SCIA?", "sintesi": "Una segnalazione."},
+    ]
+    stream = io.StringIO("".join(json.dumps(line) + "\n" for line in lines))
+    report = import_stream(bank, stream, "jsonl")
+
+    assert (report.added, report.attached, report.duplicates) == (1, 1, 1)
+    assert report.errors == [(2, "question deve essere un testo"), (3, "manca la Sintesi")]
+    snap = bank.snapshot
+    assert [c.question for c in snap.cards] == ["Cos'è il TUEL?", "Cos'è la SCIA?"]
+    assert snap.cards[0].answers[-1] == "Approfondimento: Il D.Lgs. 267/2000."
+    bank.flush()
+
+
+def test_import_stream_dry_run(tmp_path):
+    bank = _bank(tmp_path)
+    report = import_stream(bank, io.StringIO('{"question": "A?", "sintesi": "a"}\n'), "jsonl", dry_run=True)
+    assert report.added == 1
+    assert len(bank.snapshot.cards) == 1
+
+
+@pytest.mark.parametrize("data, reason", [
+    ("question,sintesi\nCos'è la città?,Un comune più grande\n".encode("latin-1"), "UTF-8"),
+    (b"question,sintesi\nA?,a\n\"B?\"," + b"x" * (1 << 18) + b"\n", "CSV non valido"),
+])
+def test_unreadable_file_imports_nothing(tmp_path, data, reason):
+    bank = _bank(tmp_path)
+    report = import_bytes(bank, data, "domande.csv")
+    assert report.failed and reason in report.failed
+    assert report.summary().startswith("❌ Importazione annullata")
+    assert len(bank.snapshot.cards) == 1
+
+
+def test_cli_reports_unreadable_file(tmp_path, capsys):
+    _bank(tmp_path)
+    source = tmp_path / "domande.csv"
+    source.write_bytes("question,sintesi\nCos'è la città?,Un comune\n".encode("latin-1"))
+    code = kb_import.main([str(source), "--db", str(tmp_path / "db.json"), "--banks-dir", str(tmp_path / "banks")])
+    assert code == 1
+    assert "non è in UTF-8" in capsys.readouterr().out
+
+
+def test_failed_backup_send_keeps_ops_for_next_delta(tmp_path):
+    bank = _bank(tmp_path)
+    full, _, version = bank.backup()
+    bank.backup_sent(version)
+
+    bank.add_answer("Cos'è la SCIA?", "Sintesi: Una segnalazione.")
+    bank.backup(delta=True)  # l'invio fallisce: backup_sent non arriva
+    bank.append_answer(1, "Collegamenti: enti locali")
+    data, filename, version = bank.backup(delta=True)
+    bank.backup_sent(version)
+    assert filename.endswith(".delta.json.gz")
+
+    # ripristino: il backup completo e poi il delta danno la versione attuale
+    restored_path = tmp_path / "ripristino.json"
+    restored_path.write_bytes(gzip.decompress(full))
+    restored = kb_store.Bank("db", str(restored_path))
+    assert kb_import.apply_delta(restored, data) == 2
+    assert restored.snapshot.to_dict() == bank.snapshot.to_dict()
+
+    # dopo un invio riuscito il delta successivo è vuoto
+    data, _, _ = bank.backup(delta=True)
+    assert json.loads(gzip.decompress(data))["ops"] == []
+    bank.flush()
+    restored.flush()
+
+
+def test_delta_of_another_bank_is_refused(tmp_path, capsys):
+    bank = _bank(tmp_path)
+    _, _, version = bank.backup()
+    bank.backup_sent(version)
+    bank.add_answer("Cos'è la SCIA?", "Sintesi: Una segnalazione.")
+    data, _, _ = bank.backup(delta=True)
+    bank.flush()
+
+    other = kb_store.Bank("diritto", str(tmp_path / "db.json"))
+    with pytest.raises(ValueError):
+        kb_import.apply_delta(other, data)
+
+    source = tmp_path / "db-1.delta.json.gz"
+    source.write_bytes(data)
+    (tmp_path / "banks").mkdir()
+    (tmp_path / "banks" / "diritto.json").write_text('{"questions": []}', encoding="utf-8")
+    code = kb_import.main([str(source), "--bank", "diritto", "--db", str(tmp_path / "db.json"),
+                           "--banks-dir", str(tmp_path / "banks")])
+    assert code == 1
+    assert "della banca 'db'" in capsys.readouterr().out
@@ -0,0 +1,168 @@
+"""
+Le strutture aggiornate card per card (indice di ricerca a shard con coda e rifusione,
+domande per testo, valutatore, quasi-duplicati, collegamenti, vettori) devono dare
+gli stessi risultati di quelle ricostruite da zero, dopo ogni modifica.
+
+    python -m pytest -q test_incremental.py
+"""
+import json
+import os
+import random
+import shutil
+
+import numpy as np
+
+import kb_search
+import kb_store
+from dedup import NearDuplicateIndex
+from grading import Grader
+from kb_search import ShardSet, filter_questions, match_shards
+from related import RelatedGraph
+from semantic import SemanticIndex
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STEPS = 120
+
+
+def _scatter(shards: ShardSet):
+    return lambda fn, *args: [fn(index, *args, skip) for index, skip in shards.segments]
+
+
+class Checker:
+    def __init__(self, bank: kb_store.Bank, rng: random.Random):
+        self.bank = bank
+        self.rng = rng
+        self.sample = random.Random(rng.random())  # le verifiche non cambiano la sequenza delle modifiche
+        cards = bank.snapshot.cards
+        self.questions = [c.question for c in cards]
+        self.words = sorted({w for q in self.questions for w in q.lower().split() if len(w) > 3})
+        self.links = ["Collegamenti: " + ", ".join(rng.sample(self.words, 2)) for _ in range(30)]
+
+    def queries(self) -> list[str]:
+        return (self.sample.sample(self.questions, 6) + self.sample.sample(self.words, 6)
+                + ["tuel", "peculato", "zzzz qualcosa", "Cos'è il comune"])
+
+    def check(self, step):
+        snap = self.bank.snapshot
+        fresh = ShardSet.build(snap.cards, kb_store.SHARD_SIZE)
+        for q in self.queries():
+            assert match_shards(_scatter(snap.shards), q, 3) == match_shards(_scatter(fresh), q, 3), (step, q)
+            for terms in (q.lower().split()[:1], []):
+                # le domande cambiate stanno in coda: /questions le rimette in ordine di ID
+                got = sorted(i for ids in _scatter(snap.shards)(filter_questions, terms) for i in ids)
+                assert got == [i for ids in _scatter(fresh)(filter_questions, terms) for i in ids], (step, q)
+
+        assert all(snap.by_id[c.id] == pos for pos, c in enumerate(snap.slots)), step
+        for q in self.queries() + [c.question.upper() for c in self.sample.sample(snap.cards, 3)]:
+            linear = next((c for c in snap.cards if c.question.lower() == q.lower()), None)
+            assert snap.find(q) is linear, (step, q)
+
+        grader = Grader(snap.cards)
+        assert (grader.n, grader.df) == (snap.grader.n, snap.grader.df), step
+        for card in self.sample.sample(snap.cards, 5):
+            assert grader.key(card).weights == snap.grader.key(card).weights, (step, card.id)
+
+        dups = NearDuplicateIndex.build(snap.cards)
+        assert dups.clusters() == snap.near_duplicates.clusters(), step
+        for q in self.queries():
+            assert dups.find(q) == snap.near_duplicates.find(q), (step, q)
+
+        related = RelatedGraph.build(snap.cards)
+        for card in snap.cards:
+            assert related.get(card.id) == snap.related.get(card.id), (step, card.id)
+
+        vectors = SemanticIndex.build(snap.cards)
+        rows = {card_id: row for row, card_id in enumerate(snap.semantic.ids) if card_id is not None}
+        assert sorted(rows) == sorted(vectors.ids), step
+        for row, card_id in enumerate(vectors.ids):
+            assert np.allclose(snap.semantic.matrix[rows[card_id]], vectors.matrix[row]), (step, card_id)
+        for q in self.queries():
+            a, b = vectors.resolve(q, 3), snap.semantic.resolve(q, 3)
+            assert a[0] == b[0] and [i for i, _ in a[1]] == [i for i, _ in b[1]], (step, q)
+
+    def answer(self) -> str:
+        """Una risposta a caso: cambia Sintesi, Approfondimento, Collegamenti o niente di tutto ciò."""
+        rng, words = self.rng, self.words
+        return rng.choice([
+            "Sintesi: " + " ".join(rng.sample(words, 3)),
+            "Approfondimento: " + " ".join(rng.sample(words, 3)),
+            rng.choice(self.links),
+            "risposta " + rng.choice(words),
+        ])
+
+    def mutate(self, step: int):
+        bank, rng, words, links = self.bank, self.rng, self.words, self.links
+        cards = bank.snapshot.cards
+        op = rng.random()
+        if op < 0.3:
+            bank.add_answer(f"{rng.choice(words)} {rng.choice(words)}?", self.answer())
+        elif op < 0.55:
+            bank.append_answer(rng.choice(cards).id, self.answer())
+        elif op < 0.75:
+            bank.delete(rng.choice(cards).id)
+        elif op < 0.85:
+            bank.add_cards([(f"{rng.choice(words)} nuova {step}", ["Sintesi: " + " ".join(rng.sample(words, 3)), rng.choice(links)])
+                            for _ in range(3)],
+                           {rng.choice(cards).id: [rng.choice(links)]})
+        elif op < 0.92:
+            bank.compact()
+        else:
+            bank.apply_ops([
+                {"op": "add", "id": bank.snapshot.next_id + 5, "question": "ripristinata " + rng.choice(words),
+                 "answers": [rng.choice(links)]},
+                {"op": "delete", "id": rng.choice(cards).id},
+            ])
+
+
+def test_incremental_structures_match_rebuilds(tmp_path, monkeypatch):
+    # shard, coda e blocchi piccoli: con le poche domande di db.json si passa da tutti i casi
+    monkeypatch.setattr(kb_store, "SHARD_SIZE", 13)
+    monkeypatch.setattr(kb_store, "SLOTS_BLOCK", 4)
+    monkeypatch.setattr(kb_search, "TAIL_MAX", 9)
+    path = tmp_path / "db.json"
+    shutil.copy(os.path.join(HERE, "db.json"), path)
+
+    bank = kb_store.Bank("db", str(path))
+    bank.snapshot.build()
+    checker = Checker(bank, random.Random(5))
+
+    folds = 0
+    for step in range(STEPS):
+        checker.mutate(step)
+        if bank.needs_fold():
+            # rifusione con modifiche arrivate nel mezzo, come fa fold_index in background
+            base = bank.snapshot._shards
+            folded = base.folded(kb_store.SHARD_SIZE)
+            bank.append_answer(checker.rng.choice(bank.snapshot.cards).id, f"durante {step}")
+            bank.delete(checker.rng.choice(bank.snapshot.cards).id)
+            bank.snapshot._shards = folded.rebased(base, bank.snapshot._shards)
+            folds += 1
+        assert not bank.snapshot.missing(*kb_store.STRUCTURES), step
+        checker.check(step)
+
+    assert folds
+    bank.fold_index()
+    checker.check("fold_index")
+
+    # il file (scritto in background) è la versione attuale
+    bank.flush()
+    with open(path, encoding="utf-8") as file:
+        assert json.load(file) == bank.snapshot.to_dict()
+
+
+if __name__ == "__main__":
+    import pytest
+    raise SystemExit(pytest.main(["-q", __file__]))
+
+
+def test_delete_copies_one_tombstone_block():
+    # con tante lapidi, una delete ricopia solo il blocco della card, non tutte le lapidi
+    deleted = kb_store.Tombstones()
+    for card_id in range(0, 50 * kb_store.SLOTS_BLOCK, 3):
+        deleted = deleted.added(card_id)
+    after = deleted.added(7 * kb_store.SLOTS_BLOCK + 1)
+
+    assert len(after) == len(deleted) + 1 and 7 * kb_store.SLOTS_BLOCK + 1 in after
+    assert [block for block, ids in after._blocks.items() if ids is not deleted._blocks[block]] == [7]
+    assert deleted.added(3) is deleted
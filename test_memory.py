@@ -0,0 +1,52 @@
+"""
+Bank.size_estimate (su cui BankManager decide quali banche scaricare) deve restare vicino
+alla RAM che una banca occupa davvero una volta scaldata, misurata con tracemalloc.
+
+    python -m pytest -q test_memory.py
+"""
+import gc
+import json
+import os
+import random
+import tracemalloc
+
+import kb_store
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CARDS = 2000
+
+
+def _write_bank(path, rng: random.Random):
+    """Domande come quelle di db.json, con un terzo delle parole cambiate: testi tutti diversi."""
+    with open(os.path.join(HERE, "db.json"), encoding="utf-8") as file:
+        base = json.load(file)["questions"]
+    words = sorted({w for q in base for text in [q["question"], *q["answers"]] for w in text.split() if len(w) > 3})
+
+    def vary(text: str) -> str:
+        return " ".join(rng.choice(words) if rng.random() < 0.3 else w for w in text.split())
+
+    questions = [{"question": vary(q["question"]), "answers": [vary(a) for a in q["answers"]]}
+                 for q in (base[i % len(base)] for i in range(CARDS))]
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"questions": questions}, file, ensure_ascii=False)
+
+
+def test_size_estimate_tracks_warmed_bank(tmp_path):
+    path = tmp_path / "grande.json"
+    _write_bank(path, random.Random(2))
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        bank = kb_store.Bank("grande", str(path))
+        before = bank.size_estimate
+        bank.warm()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # prima di scaldarla si stima già quello che occuperà dopo
+    for estimate in (before, bank.size_estimate):
+        assert 0.75 * used < estimate < 1.33 * used, (estimate, used)
@@ -0,0 +1,88 @@
+"""
+La ricerca per significato deve trovare la domanda davvero più simile anche nelle banche grandi:
+qui si confronta con il calcolo diretto della similarità con ogni domanda, su più di 2000 domande.
+
+    python -m pytest -q test_semantic.py
+"""
+import json
+import os
+import random
+
+import numpy as np
+
+from grading import _sections
+from kb_store import Card
+from semantic import SEMANTIC_MIN, SemanticIndex, vector
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CARDS = 6000
+
+QUERIES = [
+    "quali funzioni ha il sindaco?",
+    "chi è responsabile della prevenzione della corruzione",
+    "la giunta è l'organo esecutivo",
+    "segnalazione certificata inizio attività",
+    "differenza fra delibera e determina",
+    "documento unico di programmazione",
+    "appalti pubblici codice",
+    "pizza margherita ricetta",
+]
+
+
+def _bank(rng: random.Random) -> tuple[list[Card], list[str]]:
+    """Le domande di db.json e, dopo, domande di riempimento fatte con le loro parole."""
+    with open(os.path.join(HERE, "db.json"), encoding="utf-8") as file:
+        base = json.load(file)["questions"]
+    cards = [Card(i, q["question"], tuple(q["answers"])) for i, q in enumerate(base, start=1)]
+    words = sorted({w for q in base for text in [q["question"], *q["answers"]] for w in text.split() if len(w) > 3})
+    while len(cards) < CARDS:
+        question = " ".join(rng.sample(words, rng.randint(4, 8))) + "?"
+        cards.append(Card(len(cards) + 1, question, ("Sintesi: " + " ".join(rng.sample(words, 15)),)))
+    return cards, words
+
+
+def _exact(ids: list[int], matrix: np.ndarray, text: str, k: int) -> list[tuple[int, float]]:
+    """Le k domande più simili confrontando la richiesta con ognuna (a parità, la prima inserita)."""
+    vec = vector(text)
+    if not vec.any():
+        return []
+    scores = (matrix @ vec).tolist()
+    order = sorted(range(len(ids)), key=lambda row: (-scores[row], row))
+    return [(ids[row], scores[row]) for row in order[:k]]
+
+
+def test_resolve_matches_exact_search_on_large_bank():
+    rng = random.Random(7)
+    cards, words = _bank(rng)
+    index = SemanticIndex.build(cards)
+    live = {card.id: card for card in cards}
+    queries = QUERIES + [" ".join(rng.sample(words, rng.randint(2, 5))) for _ in range(40)]
+
+    def check():
+        found = 0
+        matrix = np.vstack([vector(card.question, _sections(card.answers)[0]) for card in live.values()])
+        for q in queries:
+            exact = _exact(list(live), matrix, q, 3)
+            assert [i for i, _ in index.search(q, 3)] == [i for i, _ in exact], q
+            best = exact[0][0] if exact and exact[0][1] >= SEMANTIC_MIN else None
+            assert index.best(q) == best, q
+            found += best is not None
+        return found
+
+    assert check() >= len(QUERIES) // 2
+
+    # dopo eliminazioni e modifiche (anche della domanda più simile) vale lo stesso
+    for q in QUERIES[:3]:
+        best = index.best(q)
+        index.update(live.pop(best), None)
+    for card in rng.sample(list(live.values()), 50):
+        changed = Card(card.id, card.question + " " + rng.choice(words), card.answers)
+        index.update(card, changed)
+        live[card.id] = changed
+    for i in range(5):
+        card = Card(CARDS + 1 + i, QUERIES[i], ("Sintesi: " + " ".join(rng.sample(words, 5)),))
+        index.update(None, card)
+        live[card.id] = card
+    check()
+    assert np.count_nonzero(index.matrix.any(axis=1)) == len(live)